@@ -1 +1 @@
-from spamdb import *
+from .spamdb import *
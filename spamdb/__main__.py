@@ -0,0 +1,226 @@
+"""
+Spams the models of a module into their database, or exports them to files.
+
+Usage: python -m spamdb myapp.models [Model ...] [options]
+
+Run python -m spamdb --help for the options.
+"""
+
+import argparse
+import importlib
+import sys
+import time
+
+import peewee
+
+from .spamdb import Spamdb, WritePolicy, SEEDING_PRAGMAS
+
+PROGRESS_INTERVAL = 0.5  # seconds between progress lines
+
+
+def parse_count(value):
+    """
+    Parses a Model=N count
+    """
+    name, sep, count = value.partition('=')
+    if not sep or not count.isdigit():
+        raise argparse.ArgumentTypeError('expected Model=N, got %r' % value)
+    return name, int(count)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m spamdb',
+        description='Spams the peewee models of a module into their '
+                    'database, or exports them to files.')
+    parser.add_argument('module',
+                        help='dotted path of the module defining the models')
+    parser.add_argument('models', nargs='*', metavar='model',
+                        help='names of the models to spam, all the models '
+                             'defined in the module by default')
+    parser.add_argument('-n', '--iterations', type=int, default=1,
+                        help='rows spammed for each model (default: 1)')
+    parser.add_argument('-c', '--count', type=parse_count, action='append',
+                        default=[], metavar='MODEL=N',
+                        help='rows spammed for a model, instead of '
+                             'iterations; can be repeated')
+    parser.add_argument('--seed', type=int,
+                        help='seed, to spam the same values on every run')
+    parser.add_argument('-b', '--batch-size', type=int,
+                        help='rows written per multi-row INSERT')
+    parser.add_argument('-w', '--workers', type=int,
+                        help='worker processes spamming the rows')
+    parser.add_argument('--commit-every', type=int, metavar='ROWS',
+                        help='commit every ROWS rows, instead of every row '
+                             'or batch')
+    parser.add_argument('--commit-interval', type=float, metavar='SECONDS',
+                        help='commit every SECONDS seconds, instead of '
+                             'every row or batch')
+    parser.add_argument('--sqlite-seeding', action='store_true',
+                        help='speed SQLite up at the expense of durability '
+                             'while spamming: WAL, synchronous=OFF and a '
+                             'large cache')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='save the progress of the run to FILE')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume the run saved to the checkpoint FILE')
+    parser.add_argument('--top-up', action='store_true',
+                        help='only spam the rows the tables are missing to '
+                             'hold the rows asked for')
+    parser.add_argument('--export', metavar='DIRECTORY',
+                        help='write the rows to files in DIRECTORY instead '
+                             'of the database')
+    parser.add_argument('--format', choices=('csv', 'jsonl', 'copy'),
+                        default='csv', help='format of the exported files')
+    parser.add_argument('--create-tables', action='store_true',
+                        help='create the tables that do not exist first')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not report progress')
+    parser.add_argument('--profile', action='store_true',
+                        help='report where the time was spent, at the '
+                             'expense of a slower run')
+    return parser
+
+
+def find_models(module, names):
+    """
+    Returns the models named in names, or every model defined in module
+    but the abstract ones, see is_abstract
+    """
+    if names:
+        models = []
+        for name in names:
+            model = getattr(module, name, None)
+            if not (isinstance(model, type) and
+                    issubclass(model, peewee.Model)):
+                raise LookupError('%s has no model %s' % (module.__name__,
+                                                          name))
+            models.append(model)
+        return models
+
+    models = [value for name, value in sorted(vars(module).items())
+              if isinstance(value, type) and issubclass(value, peewee.Model)
+              and value.__module__ == module.__name__]
+    return [model for model in models if not is_abstract(model, models)]
+
+
+def is_abstract(model, models):
+    """
+    Tells whether a model is only a base of other models, like one setting
+    the database in its Meta: it is subclassed by one of models and has no
+    field but its auto incremented primary key
+    """
+    return model._meta.auto_increment and \
+        len(model._meta.get_fields()) == 1 and \
+        any(other is not model and issubclass(other, model)
+            for other in models)
+
+
+class Progress(object):
+    """
+    Spamdb progress callback writing the rows spammed so far and the rows
+    per second
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self.rows = 0
+        self.start = self.last = time.time()
+
+    def __call__(self, model, n):
+        self.rows += n
+        now = time.time()
+        if now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.write(now)
+
+    def write(self, now, end=''):
+        elapsed = now - self.start
+        self.stream.write('\r%d rows, %.0f rows/sec%s' % (
+            self.rows, self.rows / elapsed if elapsed else 0, end))
+        self.stream.flush()
+
+
+def write_stats(stats, stream=None):
+    """
+    Writes the counters of a profiling Spamdb, the slowest first
+    """
+    stream = stream or sys.stderr
+    timings = []
+    for event, names in stats.items():
+        if event == 'rows' or not isinstance(names, dict):
+            continue
+        for name, timing in names.items():
+            timings.append((timing['seconds'], event, name, timing['calls']))
+    for seconds, event, name, calls in sorted(timings, reverse=True):
+        stream.write('%-10s %-30s %10d calls %10.3f sec\n' % (
+            event, name, calls, seconds))
+    stream.write('%d queries, %d key pool hits, %d misses\n' % (
+        stats['queries'], stats['pool_hits'], stats['pool_misses']))
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    if args.export and args.workers is not None:
+        sys.stderr.write('--workers cannot be used with --export\n')
+        return 2
+
+    try:
+        module = importlib.import_module(args.module)
+        models = find_models(module, args.models)
+    except (ImportError, LookupError) as e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+
+    counts = {}
+    for name, count in args.count:
+        model = getattr(module, name, None)
+        if model not in models:
+            sys.stderr.write('%s is not a selected model\n' % name)
+            return 2
+        counts[model] = count
+
+    write_policy = None
+    if args.commit_every is not None or args.commit_interval is not None:
+        if args.workers is not None:
+            sys.stderr.write('warning: --commit-every and --commit-interval '
+                             'have no effect with --workers, each shard is '
+                             'committed on its own\n')
+        write_policy = WritePolicy(args.commit_every, args.commit_interval)
+    progress = None if args.quiet else Progress()
+    sdb = Spamdb(*models, seed=args.seed, profile=args.profile,
+                 progress=progress, write_policy=write_policy,
+                 sqlite_pragmas=SEEDING_PRAGMAS if args.sqlite_seeding
+                 else None)
+
+    if args.create_tables and not args.export:
+        levels, _ = sdb.dependency_levels()
+        for model in sorted(models, key=lambda model: levels[model]):
+            model.create_table(True)
+
+    if args.export:
+        kwargs = {}
+        if args.batch_size:
+            kwargs['batch_size'] = args.batch_size
+        results = sdb.export(args.export, format=args.format,
+                             iterations=args.iterations, counts=counts,
+                             **kwargs)
+    else:
+        run = sdb.ensure if args.top_up else sdb.run
+        results = run(iterations=args.iterations, batch_size=args.batch_size,
+                      workers=args.workers, counts=counts,
+                      checkpoint=args.checkpoint, resume=args.resume)
+
+    if progress is not None:
+        progress.write(time.time(), end='\n')
+    if args.profile:
+        write_stats(sdb.stats())
+
+    for model in models:
+        if model in results:
+            print('%s: %s' % (model.__name__, results[model]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
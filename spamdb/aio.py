@@ -0,0 +1,126 @@
+"""
+Asynchronous engine behind Spamdb.arun, overlapping the generation of rows
+with their writes. Requires Python 3.5 or later.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+
+def thread_local(database):
+    """
+    Tells whether peewee keeps a connection to a database for each thread
+    """
+    threadlocals = getattr(database, 'threadlocals', None)
+    if threadlocals is not None:
+        return threadlocals
+    # older versions only keep it in a private attribute
+    local = getattr(database, '_Database__local',
+                    getattr(database, '_local', None))
+    return isinstance(local, threading.local)
+
+
+class ExecutorWriter(object):
+    """
+    Adapts the blocking peewee databases to asyncio, writing rows from the
+    threads of an executor, one for each connection. The databases must be
+    created with threadlocals=True for each thread to get a connection of
+    its own, which is opened through the ConnectionPool of the run; a
+    ValueError is raised otherwise.
+    """
+
+    def __init__(self, sdb, connections=1, executor=None):
+        for model in sdb:
+            if not thread_local(model._meta.database):
+                raise ValueError('arun writes from threads, the database of '
+                                 '%s must be created with threadlocals=True'
+                                 % model.__name__)
+        self.sdb = sdb
+        self.connections = connections
+        self.own_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(connections)
+        self.executor = executor
+
+    async def write(self, model, rows):
+        """
+        Inserts a list of dicts as returned by spam_rows.
+        Returns the number of inserted rows.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._write, model,
+                                          rows)
+
+    def _write(self, model, rows):
+        if self.sdb.connections is not None:
+            self.sdb.connections.connect()
+        return self.sdb.insert_rows(model, rows)
+
+    def close(self):
+        if self.own_executor:
+            self.executor.shutdown()
+
+
+async def arun(sdb, iterations, batch_size, counts, connections, queue_size,
+               writer):
+    """
+    See Spamdb.arun
+    """
+    if writer is None:
+        writer = ExecutorWriter(sdb, connections)
+    queue = asyncio.Queue(maxsize=queue_size or 2 * writer.connections)
+    positions = [0] * len(sdb)
+    errors = []
+
+    async def consume():
+        while True:
+            position, rows = await queue.get()
+            try:
+                if not errors:  # otherwise drain the queue
+                    count = await writer.write(sdb[position], rows)
+                    positions[position] += count
+            except Exception as e:
+                errors.append(e)
+            finally:
+                queue.task_done()
+
+    sdb._open_connections()
+    try:
+        sizes, schedule, levels, deferred, last_keys = sdb._begin_run(
+            iterations, counts)
+        consumers = [asyncio.ensure_future(consume())
+                     for i in range(writer.connections)]
+        try:
+            for level in sorted(set(levels.values())):
+                for position in schedule:
+                    model = sdb[position]
+                    if levels[model] != level:
+                        continue
+                    if model in sdb.trees:
+                        # each level of a tree needs the keys of the
+                        # previous one
+                        for rows in sdb.iter_tree(model, sizes[position],
+                                                  batch_size):
+                            count = await writer.write(model, rows)
+                            positions[position] += count
+                        continue
+                    for start in range(0, sizes[position], batch_size):
+                        rows = sdb.spam_rows(
+                            model, min(batch_size, sizes[position] - start))
+                        await queue.put((position, rows))
+                        if errors:
+                            raise errors[0]
+                # rows of the next level may point to the ones in the queue
+                await queue.join()
+                if errors:
+                    raise errors[0]
+        finally:
+            for consumer in consumers:
+                consumer.cancel()
+            sdb._end_run()
+            writer.close()
+
+        return sdb._finish_run(deferred, last_keys, positions, batch_size)
+    finally:
+        sdb._close_connections()
@@ -0,0 +1,318 @@
+"""
+Benchmarks for spamdb.
+
+Usage: python -m spamdb.bench [--rows N] [--json FILE] [--only GROUP ...]
+
+Every result is printed, and written to FILE as JSON with --json, so the
+numbers of two versions can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import peewee
+
+from . import lorem_ipsum
+from .spamdb import Spamdb, KeyPool, SUPER_GLOBAL_HANDLERS, TextPool,\
+    text_handler, WritePolicy, SEEDING_PRAGMAS
+
+database = peewee.SqliteDatabase(':memory:')
+
+GROUPS = ('startup', 'overhead', 'handlers', 'lorem_ipsum', 'spam', 'run')
+
+
+def make_model(name, columns, field_class=peewee.IntegerField,
+               database=database, **kwargs):
+    """
+    Returns a model class with `columns` fields of the given class
+    """
+    attrs = dict(('f%d' % i, field_class(**kwargs)) for i in range(columns))
+    return _model(name, database, attrs)
+
+
+def _model(name, database, attrs):
+    attrs['Meta'] = type('Meta', (object,), {'database': database})
+    return type(name, (peewee.Model,), attrs)
+
+
+def make_models(database):
+    """
+    Returns the matrix of models benchmarked by spam and run: a dict of
+    names to lists of (model, share of the rows) tuples, parents first
+    """
+    wide = _model('Wide', database, {
+        'f%d' % i: field_class() for i, field_class in enumerate(
+            [peewee.IntegerField, peewee.BigIntegerField, peewee.FloatField,
+             peewee.DecimalField, peewee.BooleanField, peewee.DateTimeField,
+             peewee.DateField, peewee.TimeField, peewee.CharField,
+             peewee.DoubleField] * 2)})
+    narrow = _model('Narrow', database, {'number': peewee.IntegerField(),
+                                         'name': peewee.CharField()})
+    parent = _model('Parent', database, {'name': peewee.CharField()})
+    fk_heavy = _model('FkHeavy', database, dict(
+        ('parent%d' % i, peewee.ForeignKeyField(
+            parent, related_name='fk_heavy%d' % i)) for i in range(5)))
+    text_heavy = make_model('TextHeavy', 5, peewee.TextField,
+                            database=database)
+    return {
+        'wide': [(wide, 1)],
+        'narrow': [(narrow, 1)],
+        'fk_heavy': [(parent, 0.1), (fk_heavy, 1)],
+        'text_heavy': [(text_heavy, 1)],
+    }
+
+
+def _best(call, number=1, repeat=3):
+    return min(timeit.repeat(call, number=number, repeat=repeat))
+
+
+def _noop(model, field_type, field_name):
+    return 0
+
+
+def bench_spam_fields_overhead(rows=20000, columns=20):
+    """
+    Seconds per row spent by Spamdb.spam_fields around the field handlers,
+    measured with handlers that do nothing.
+    """
+    model = make_model('WideModel', columns)
+    sdb = Spamdb(model)
+    sdb.global_handler(peewee.IntegerField)(_noop)
+    sdb.global_handler(peewee.PrimaryKeyField)(_noop)
+    return _best(lambda: sdb.spam_fields(model), number=rows) / rows
+
+
+def bench_spam_rows(rows=5000, columns=20, field_class=peewee.IntegerField):
+    """
+    Seconds per row spent spamming a wide model with the built-in handlers,
+    one row at a time with spam_fields and one column at a time with
+    spam_rows.
+    """
+    model = make_model('Wide%s' % field_class.__name__, columns, field_class)
+    sdb = Spamdb(model)
+    by_row = _best(lambda: sdb.spam_fields(model), number=rows)
+    by_column = _best(lambda: sdb.spam_rows(model, rows))
+    return by_row / rows, by_column / rows
+
+
+def bench_handlers(number=5000):
+    """
+    Seconds per call of the built-in handler of each field type
+    """
+    results = []
+    for field_class, handler in sorted(SUPER_GLOBAL_HANDLERS.items(),
+                                       key=lambda item: item[0].__name__):
+        if field_class is peewee.ForeignKeyField:
+            # picks a key out of the pool of the related model
+            parent = make_model('HandlerParent', 1)
+            model = _model('HandlerModel', database,
+                           {'f0': peewee.ForeignKeyField(parent)})
+            sdb = Spamdb(model)
+            sdb.key_pools[parent] = KeyPool(parent, keys=range(1, 1001))
+            handler = sdb.spam_foreignkeyfield
+        else:
+            model = make_model('Handler%s' % field_class.__name__, 1,
+                               field_class)
+        params = (model, field_class, 'f0')
+        per_call = _best(lambda: handler(*params), number=number) / number
+        results.append((field_class.__name__, per_call))
+
+    model = make_model('HandlerText', 1, peewee.TextField)
+    for name, handler in (
+            ('text_handler(length=(100, 4000))',
+             text_handler(length=(100, 4000))),
+            ('text_handler(length=(100, 4000), pool)',
+             text_handler(length=(100, 4000), pool=TextPool()))):
+        per_call = _best(lambda: handler(model, peewee.TextField, 'f0'),
+                         number=number) / number
+        results.append((name, per_call))
+    return results
+
+
+IMPORT_CODE = '''
+import time
+import peewee
+start = time.time()
+import spamdb
+imported = time.time()
+spamdb.lorem_ipsum.sentence()
+print('%r %r' % (imported - start, time.time() - imported))
+'''
+
+
+def bench_import(repeat=5):
+    """
+    Seconds spent importing spamdb in a new interpreter, after peewee, which
+    the models being spammed import anyway, and seconds spent by the first
+    lorem_ipsum call, which builds its tables
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [path for path in [env.get('PYTHONPATH')] if path])
+    times = [[float(t) for t in subprocess.check_output(
+        [sys.executable, '-c', IMPORT_CODE], env=env).split()]
+        for i in range(repeat)]
+    return min(t[0] for t in times), min(t[1] for t in times)
+
+
+def bench_lorem_ipsum(number=10000):
+    """
+    Seconds per call of the lorem_ipsum functions
+    """
+    calls = (
+        ('sentence()', lorem_ipsum.sentence),
+        ('sentences(10)', lambda: lorem_ipsum.sentences(10)),
+        ('paragraph()', lorem_ipsum.paragraph),
+        ('paragraphs(5)', lambda: lorem_ipsum.paragraphs(5)),
+        ('words(50)', lambda: lorem_ipsum.words(50)),
+    )
+    return [(name, _best(call, number=number) / number)
+            for name, call in calls]
+
+
+def bench_spam(models, rows):
+    """
+    Seconds per row spent by spam_fields, spam_model and spam_rows on the
+    last model of a list as returned by make_models, without saving
+    """
+    model = models[-1][0]
+    sdb = Spamdb(model)
+    for parent, share in models[:-1]:
+        sdb.key_pools[parent] = KeyPool(parent, keys=range(1, 101))
+    return [
+        ('spam_fields', _best(lambda: sdb.spam_fields(model),
+                              number=rows) / rows),
+        ('spam_model', _best(lambda: sdb.spam_model(model),
+                             number=rows) / rows),
+        ('spam_rows', _best(lambda: sdb.spam_rows(model, rows)) / rows),
+    ]
+
+
+def bench_run(models, rows, batch_size=None, server_side=False, **kwargs):
+    """
+    Rows per second saved by run() for a list of models as returned by
+    make_models, into freshly created tables. kwargs are passed to Spamdb.
+    """
+    sdb = Spamdb(**kwargs)
+    total = 0
+    for model, share in models:
+        sdb.append(model, count=max(1, int(rows * share)))
+        total += sdb.counts[model]
+
+    def setup():
+        for model, share in reversed(models):
+            model.drop_table(True)
+        for model, share in models:
+            model.create_table()
+
+    elapsed = min(timeit.repeat(
+        lambda: sdb.run(batch_size=batch_size, server_side=server_side),
+        setup=setup, number=1, repeat=3))
+    return total / elapsed
+
+
+def run_benchmarks(rows=2000, only=GROUPS, log=None):
+    """
+    Runs the benchmark groups in only. rows scales the number of rows
+    spammed by each benchmark. Each result is passed to log as it comes.
+    Returns a list of dicts with the name, value and unit of each result.
+    """
+    results = []
+
+    def add(name, value, unit):
+        result = {'name': name, 'value': value, 'unit': unit}
+        results.append(result)
+        if log is not None:
+            log(result)
+
+    if 'startup' in only:
+        import_time, first_call = bench_import()
+        add('import spamdb', import_time * 1e3, 'ms')
+        add('lorem_ipsum first call', first_call * 1e3, 'ms')
+
+    if 'overhead' in only:
+        add('spam_fields overhead',
+            bench_spam_fields_overhead(rows * 10) * 1e6, 'us/row')
+        for field_class in (peewee.IntegerField, peewee.FloatField,
+                            peewee.BooleanField, peewee.DateTimeField,
+                            peewee.DateField, peewee.TimeField):
+            by_row, by_column = bench_spam_rows(rows * 2,
+                                                field_class=field_class)
+            add('%s x20 spam_fields' % field_class.__name__, by_row * 1e6,
+                'us/row')
+            add('%s x20 spam_rows' % field_class.__name__, by_column * 1e6,
+                'us/row')
+
+    if 'handlers' in only:
+        for name, per_call in bench_handlers(rows * 2):
+            add('handler %s' % name, per_call * 1e6, 'us/call')
+
+    if 'lorem_ipsum' in only:
+        for name, per_call in bench_lorem_ipsum(rows * 5):
+            add('lorem_ipsum.%s' % name, per_call * 1e6, 'us/call')
+
+    if 'spam' in only:
+        for name, models in sorted(make_models(database).items()):
+            for function, per_row in bench_spam(models, rows):
+                add('%s %s' % (name, function), per_row * 1e6, 'us/row')
+
+    if 'run' in only:
+        seeding = {'write_policy': WritePolicy(rows=10000),
+                   'sqlite_pragmas': SEEDING_PRAGMAS}
+        directory = tempfile.mkdtemp()
+        try:
+            for db_name, path in (('memory', ':memory:'),
+                                  ('file', os.path.join(directory, 'db'))):
+                db = peewee.SqliteDatabase(path)
+                for name, models in sorted(make_models(db).items()):
+                    for mode, kwargs in (
+                            ('per row', {}),
+                            ('per row seeding', seeding),
+                            ('batch', {'batch_size': 500}),
+                            ('batch seeding', dict(seeding, batch_size=500)),
+                            ('server side', {'batch_size': 500,
+                                             'server_side': True})):
+                        add('%s %s run %s' % (db_name, name, mode),
+                            bench_run(models, rows, **kwargs), 'rows/s')
+                db.close()
+        finally:
+            shutil.rmtree(directory)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m spamdb.bench',
+                                     description='Benchmarks for spamdb')
+    parser.add_argument('--rows', type=int, default=2000,
+                        help='scales the rows spammed by each benchmark')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results as JSON to FILE')
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=GROUPS,
+                        help='benchmark groups to run')
+    args = parser.parse_args(argv)
+
+    def log(result):
+        print('%s: %.2f %s' % (result['name'], result['value'],
+                               result['unit']))
+
+    results = run_benchmarks(args.rows, args.only, log)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': sys.platform,
+                       'rows': args.rows,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
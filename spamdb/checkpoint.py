@@ -0,0 +1,50 @@
+"""
+Checkpoint files recording the progress of Spamdb.run, so a failed run can
+be resumed.
+"""
+
+import json
+import os
+
+# os.replace overwrites the target on every platform, rename only on POSIX
+_replace = getattr(os, 'replace', os.rename)
+
+
+def save(path, state):
+    """
+    Writes a JSON serializable state to path atomically: the state is
+    written to a temporary file, flushed to disk and renamed over path, so
+    path always holds a complete checkpoint.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    _replace(tmp_path, path)
+
+
+def load(path):
+    """
+    Returns the state saved to path, or None if there is no checkpoint
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def random_state(rng):
+    """
+    Returns the state of a random.Random as JSON serializable lists
+    """
+    version, internal, gauss_next = rng.getstate()
+    return [version, list(internal), gauss_next]
+
+
+def set_random_state(rng, state):
+    """
+    Restores a state returned by random_state
+    """
+    version, internal, gauss_next = state
+    rng.setstate((version, tuple(internal), gauss_next))
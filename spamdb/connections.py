@@ -0,0 +1,202 @@
+"""
+Connections and transactions of the databases Spamdb.run writes to: the
+policy deciding when spammed rows are committed, the SQLite pragmas
+connections are opened with, and the counting of the queries run.
+"""
+
+import threading
+import timeit
+
+import peewee
+
+# pragmas trading durability for speed while seeding a SQLite database: a
+# crash may lose the last transactions, but not corrupt the file
+SEEDING_PRAGMAS = (
+    ('journal_mode', 'wal'),
+    ('synchronous', 'off'),
+    ('cache_size', -262144),  # in KiB when negative, 256 MiB
+    ('temp_store', 'memory'),
+)
+
+# pragmas stored in the database file, which are not restored
+PERSISTENT_PRAGMAS = ('journal_mode',)
+
+
+class WritePolicy(object):
+    """
+    Commits the rows spammed by run() every `rows` rows or every `seconds`
+    seconds, whichever comes first, instead of saving every row, or every
+    batch, in a transaction of its own. With neither, rows are committed
+    once the run is done.
+    """
+
+    def __init__(self, rows=None, seconds=None):
+        self.rows = rows
+        self.seconds = seconds
+
+    def due(self, rows, seconds):
+        """
+        Tells whether to commit, given the rows written and the seconds
+        elapsed since the last commit
+        """
+        return (self.rows is not None and rows >= self.rows) or \
+            (self.seconds is not None and seconds >= self.seconds)
+
+
+class Transactions(object):
+    """
+    Keeps a transaction open on each database, committing them all when
+    the WritePolicy is due. Transactions opened inside, like the ones of
+    Spamdb.insert_rows, become part of these.
+    """
+
+    def __init__(self, databases, policy):
+        self.databases = list(databases)
+        self.policy = policy
+        self.transactions = []
+        self.pending = 0  # rows written since the last commit
+        self.last_commit = None
+
+    def __enter__(self):
+        for database in self.databases:
+            transaction = database.transaction()
+            transaction.__enter__()
+            self.transactions.append(transaction)
+        self.last_commit = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        while self.transactions:
+            self.transactions.pop().__exit__(exc_type, exc_val, exc_tb)
+
+    def wrote(self, rows):
+        """
+        Counts rows just written, committing if the policy is due
+        """
+        self.pending += rows
+        if self.policy.due(self.pending,
+                           timeit.default_timer() - self.last_commit):
+            self.commit()
+
+    def commit(self):
+        for transaction in self.transactions:
+            transaction.commit()
+        self.pending = 0
+        self.last_commit = timeit.default_timer()
+
+
+class ConnectionPool(object):
+    """
+    Hands out the connections spammed rows are written through. peewee
+    keeps a connection per database for each thread, or for the whole
+    process; the pool opens them when needed and configures each one once,
+    so the main process, the worker processes of run() and the threads of
+    arun() all write through connections set up alike. Only SQLite
+    databases get the pragmas.
+    """
+
+    def __init__(self, databases, sqlite_pragmas=None):
+        self.databases = list(databases)
+        self.sqlite_pragmas = sqlite_pragmas or ()
+        self.lock = threading.Lock()
+        self.configured = {}  # previous pragmas, by id of connection
+
+    def connect(self, reopen=False):
+        """
+        Makes sure the current thread has an open connection to every
+        database, configured with the pragmas. With reopen=True new
+        connections are opened, e.g. in forked worker processes, which must
+        not use the connections of their parent.
+        """
+        for database in self.databases:
+            if reopen:
+                database.connect()
+            connection = database.get_conn()
+            if not self.sqlite_pragmas or \
+                    not isinstance(database, peewee.SqliteDatabase):
+                continue
+            with self.lock:
+                if id(connection) in self.configured:
+                    continue
+                self.configured[id(connection)] = (
+                    threading.current_thread(), connection,
+                    self._set_pragmas(connection))
+
+    def _set_pragmas(self, connection):
+        """
+        Returns the previous value of the pragmas not stored in the file
+        """
+        previous = []
+        for name, value in self.sqlite_pragmas:
+            if name not in PERSISTENT_PRAGMAS:
+                row = connection.execute('PRAGMA %s' % name).fetchone()
+                previous.append((name, row[0]))
+            connection.execute('PRAGMA %s = %s' % (name, value))
+        return previous
+
+    def restore(self):
+        """
+        Puts back the pragmas changed on the connections of the current
+        thread. Connections of other threads keep them until closed.
+        """
+        thread = threading.current_thread()
+        with self.lock:
+            for key, (owner, connection, previous) in \
+                    list(self.configured.items()):
+                if owner is thread:
+                    for name, value in previous:
+                        connection.execute('PRAGMA %s = %s' % (name, value))
+                del self.configured[key]
+
+
+class QueryCounter(object):
+    """
+    Stands for the execute_sql method of a database while profiling runs
+    use it, counting each query for every one of them. Runs may nest or
+    overlap on a shared database: the first one installs the counter, and
+    the last one to end puts back the execute_sql attribute the database
+    had before.
+    """
+    lock = threading.Lock()
+
+    def __init__(self, database):
+        self.database = database
+        self.installed = 'execute_sql' in database.__dict__
+        self.previous = database.__dict__.get('execute_sql')
+        self.execute_sql = database.execute_sql
+        self.sdbs = []
+
+    def __call__(self, *args, **kwargs):
+        for sdb in self.sdbs:
+            sdb.queries += 1
+        return self.execute_sql(*args, **kwargs)
+
+    @classmethod
+    def add(cls, database, sdb):
+        """
+        Counts the queries run on a database for a Spamdb.
+        Returns the counter, to be passed to remove.
+        """
+        with cls.lock:
+            counter = database.__dict__.get('execute_sql')
+            if not isinstance(counter, cls):
+                counter = cls(database)
+                database.execute_sql = counter
+            counter.sdbs.append(sdb)
+        return counter
+
+    def remove(self, sdb):
+        """
+        Stops counting the queries for a Spamdb, restoring the database
+        after the last one. A counter wrapped by someone else since is
+        left in place.
+        """
+        with self.lock:
+            self.sdbs.remove(sdb)
+            if self.sdbs or \
+                    self.database.__dict__.get('execute_sql') is not self:
+                return
+            if self.installed:
+                self.database.execute_sql = self.previous
+            else:
+                del self.database.execute_sql
@@ -0,0 +1,69 @@
+"""
+Fan-out distributions, deciding how the rows of a model are spread among
+the rows their foreign keys point to. See Spamdb.fan_out.
+"""
+
+import bisect
+
+
+class Distribution(object):
+    """
+    Picks the parent of each spammed row out of a list of primary keys
+    """
+
+    def sample(self, keys, rng):
+        """
+        Returns one of keys, which is never empty, using the random.Random
+        given
+        """
+        raise NotImplementedError
+
+
+class Uniform(Distribution):
+    """
+    Every parent is equally likely, the default
+    """
+
+    def sample(self, keys, rng):
+        return rng.choice(keys)
+
+
+class Zipf(Distribution):
+    """
+    The parent at rank k, counting keys in order from 1, is picked with a
+    probability proportional to 1 / k ** s: a few parents get most of the
+    rows and most parents get a few of them.
+    """
+
+    def __init__(self, s=1.0):
+        self.s = s
+        self.cumulative = []  # cumulative weights of the first ranks
+
+    def sample(self, keys, rng):
+        n = len(keys)
+        cumulative = self.cumulative
+        if n > len(cumulative):
+            # weights do not depend on n, so they are only extended
+            total = cumulative[-1] if cumulative else 0.0
+            for k in range(len(cumulative) + 1, n + 1):
+                total += 1.0 / k ** self.s
+                cumulative.append(total)
+        x = rng.random() * cumulative[n - 1]
+        return keys[bisect.bisect_right(cumulative, x, 0, n)]
+
+
+class FixedPerParent(Distribution):
+    """
+    Hands each parent exactly `count` rows, in order, starting over from
+    the first parent once every one got its rows. Rows are counted by the
+    distribution itself, so runs with workers can not follow it.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.spammed = 0
+
+    def sample(self, keys, rng):
+        key = keys[(self.spammed // self.count) % len(keys)]
+        self.spammed += 1
+        return key
@@ -0,0 +1,125 @@
+"""
+Writers used by Spamdb.export to stream spammed rows to files that
+database loaders can read, instead of saving them through peewee.
+"""
+
+import datetime
+import decimal
+import io
+import json
+
+BUFFER_SIZE = 1 << 20  # bytes buffered before writing to disk
+
+text_type = type(u'')
+
+
+def _isoformat(value):
+    if isinstance(value, datetime.datetime):
+        return text_type(value.isoformat(' '))
+    return text_type(value.isoformat())
+
+
+class Writer(object):
+    """
+    Writes rows, as tuples of column values, to a file
+    """
+    extension = None
+
+    def __init__(self, path, columns):
+        self.columns = columns
+        self.file = io.open(path, 'w', encoding='utf-8', newline='',
+                            buffering=BUFFER_SIZE)
+
+    def write_rows(self, rows):
+        self.file.write(u''.join([self.format_row(row) for row in rows]))
+
+    def format_row(self, row):
+        raise NotImplementedError
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter(Writer):
+    """
+    Comma separated values, with a header line. NULL values are left empty
+    and empty strings are quoted, as PostgreSQL's COPY ... CSV expects.
+    """
+    extension = 'csv'
+
+    def __init__(self, path, columns):
+        super(CsvWriter, self).__init__(path, columns)
+        self.file.write(self.format_row(columns))
+
+    def format_value(self, value):
+        if value is None:
+            return u''
+        if isinstance(value, bool):
+            return u'1' if value else u'0'
+        if isinstance(value, float):
+            return text_type(repr(value))
+        if isinstance(value, (datetime.date, datetime.time)):
+            return _isoformat(value)
+        value = text_type(value)
+        if not value or any(c in value for c in u',"\r\n'):
+            return u'"%s"' % value.replace(u'"', u'""')
+        return value
+
+    def format_row(self, row):
+        return u','.join([self.format_value(value) for value in row]) + u'\n'
+
+
+class JsonLinesWriter(Writer):
+    """
+    One JSON object per line, keyed by column name. Dates and times are
+    written in ISO 8601 format, decimals as strings.
+    """
+    extension = 'jsonl'
+
+    def format_value(self, value):
+        if isinstance(value, (datetime.date, datetime.time)):
+            return _isoformat(value)
+        if isinstance(value, decimal.Decimal):
+            return text_type(value)
+        return value
+
+    def format_row(self, row):
+        obj = dict(zip(self.columns,
+                       [self.format_value(value) for value in row]))
+        return text_type(json.dumps(obj, sort_keys=True)) + u'\n'
+
+
+class CopyWriter(Writer):
+    """
+    PostgreSQL's COPY text format: tab separated columns, NULL as \\N and
+    backslash escapes.
+    """
+    extension = 'copy'
+
+    escapes = ((u'\\', u'\\\\'), (u'\t', u'\\t'), (u'\n', u'\\n'),
+               (u'\r', u'\\r'))
+
+    def format_value(self, value):
+        if value is None:
+            return u'\\N'
+        if isinstance(value, bool):
+            return u't' if value else u'f'
+        if isinstance(value, float):
+            return text_type(repr(value))
+        if isinstance(value, (datetime.date, datetime.time)):
+            return _isoformat(value)
+        value = text_type(value)
+        for char, escape in self.escapes:
+            if char in value:
+                value = value.replace(char, escape)
+        return value
+
+    def format_row(self, row):
+        return u'\t'.join([self.format_value(value) for value in row]) + u'\n'
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'jsonl': JsonLinesWriter,
+    'copy': CopyWriter,
+}
@@ -40,29 +40,121 @@ COMMON_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur',
         'adipisicing', 'elit', 'sed', 'do', 'eiusmod', 'tempor', 'incididunt',
         'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua')
 
-def sentence():
+# Lookup tables used to build text by slicing a precomputed corpus instead of
+# sampling and joining words one by one. The corpus is made of RING_SIZE
+# shuffled copies of WORDS, each one followed by itself again, so that any
+# run of up to len(WORDS) words starting in the first half of a copy has no
+# repeated words, like random.sample() would return.
+RING_SIZE = 32
+
+def _build_ring(size):
+    shuffler = random.Random(0)
+    ring, offsets = [], []
+    for i in range(size):
+        copy = list(WORDS)
+        shuffler.shuffle(copy)
+        offsets.extend(range(len(ring), len(ring) + len(copy)))
+        ring.extend(copy + copy)
+    text = u' '.join(ring) + u' '
+    starts, position = [], 0
+    for word in ring:
+        starts.append(position)
+        position += len(word) + 1
+    starts.append(position)
+    return text, starts, offsets
+
+_ring = None  # (text, starts, offsets), built the first time it is needed
+
+def _load_ring():
+    global _ring
+    _ring = _build_ring(RING_SIZE)
+    return _ring
+
+def _section(count, rng):
+    """
+    Returns `count` (at most len(WORDS)) distinct random words separated by
+    a single space.
+    """
+    text, starts, offsets = _ring or _load_ring()
+    offset = offsets[int(rng.random() * len(offsets))]
+    return text[starts[offset]:starts[offset + count] - 1]
+
+def sentence(max_length=None, rng=None):
     """
     Returns a randomly generated sentence of lorem ipsum text.
 
     The first word is capitalized, and the sentence ends in either a period or
     question mark. Commas are added at random.
+
+    If `max_length` is given, no more sections are added once the sentence
+    reaches that length, and it is cut to at most `max_length` characters.
+
+    All the functions in this module take an optional `rng`, a random.Random
+    instance used instead of the random module.
     """
     # Determine the number of comma-separated sections and number of words in
     # each section for this sentence.
-    sections = [u' '.join(random.sample(WORDS, random.randint(3, 12))) for i in range(random.randint(1, 5))]
-    s = u', '.join(sections)
+    rng = rng or random
+    rand = rng.random
+    count = 1 + int(rand() * 5)
+    if max_length is None:
+        s = u', '.join([_section(3 + int(rand() * 10), rng)
+                        for i in range(count)])
+    else:
+        sections, length = [], -2
+        for i in range(count):
+            section = _section(3 + int(rand() * 10), rng)
+            sections.append(section)
+            length += len(section) + 2
+            if length >= max_length:
+                break
+        s = u', '.join(sections)
     # Convert to sentence case and add end punctuation.
-    return u'%s%s%s' % (s[0].upper(), s[1:], random.choice('?.'))
+    s = s[0].upper() + s[1:] + (u'?' if rand() < 0.5 else u'.')
+    if max_length is not None and max_length < len(s):
+        return s[:max_length].strip()
+    return s
+
+SHORT_LENGTH = 32  # short_sentence() caches sentences up to this length
+SHORT_CACHE_SIZE = 1024
+
+_short_sentences = {}
 
-def paragraph():
+def short_sentence(max_length, rng=None):
+    """
+    Returns a sentence as returned by sentence(max_length).
+
+    When `max_length` is at most SHORT_LENGTH, the sentence is picked from
+    SHORT_CACHE_SIZE candidates generated the first time that length is
+    requested. Candidates are always the same for a given length.
+    """
+    rng = rng or random
+    if max_length > SHORT_LENGTH:
+        return sentence(max_length, rng)
+    candidates = _short_sentences.get(max_length)
+    if candidates is None:
+        generator = random.Random(max_length)
+        candidates = [sentence(max_length, generator)
+                      for i in range(SHORT_CACHE_SIZE)]
+        _short_sentences[max_length] = candidates
+    return candidates[int(rng.random() * SHORT_CACHE_SIZE)]
+
+def sentences(count, rng=None):
+    """
+    Returns a list of `count` sentences as returned by sentence().
+    """
+    return [sentence(rng=rng) for i in range(count)]
+
+def paragraph(rng=None):
     """
     Returns a randomly generated paragraph of lorem ipsum text.
 
     The paragraph consists of between 1 and 4 sentences, inclusive.
     """
-    return u' '.join([sentence() for i in range(random.randint(1, 4))])
+    rng = rng or random
+    return u' '.join(sentences(1 + int(rng.random() * 4), rng))
 
-def paragraphs(count, common=True):
+def paragraphs(count, common=True, rng=None):
     """
     Returns a list of paragraphs as returned by paragraph().
 
@@ -70,21 +162,18 @@ def paragraphs(count, common=True):
     'lorem ipsum' paragraph. Otherwise, the first paragraph will be random
     Latin text. Either way, subsequent paragraphs will be random Latin text.
     """
-    paras = []
-    for i in range(count):
-        if common and i == 0:
-            paras.append(COMMON_P)
-        else:
-            paras.append(paragraph())
-    return paras
+    if common and count > 0:
+        return [COMMON_P] + [paragraph(rng) for i in range(count - 1)]
+    return [paragraph(rng) for i in range(count)]
 
-def words(count, common=True):
+def words(count, common=True, rng=None):
     """
     Returns a string of `count` lorem ipsum words separated by a single space.
 
     If `common` is True, then the first 19 words will be the standard
     'lorem ipsum' words. Otherwise, all words will be selected randomly.
     """
+    rng = rng or random
     if common:
         word_list = list(COMMON_WORDS)
     else:
@@ -95,7 +184,23 @@ def words(count, common=True):
         while count > 0:
             c = min(count, len(WORDS))
             count -= c
-            word_list += random.sample(WORDS, c)
+            word_list.append(_section(c, rng))
     else:
         word_list = word_list[:count]
-    return u' '.join(word_list)
\ No newline at end of file
+    return u' '.join(word_list)
+
+class TextPool(object):
+    """
+    A fixed number of paragraphs, generated once, to build texts out of
+    them instead of generating new paragraphs for every text.
+    """
+
+    def __init__(self, size=1024, seed=0):
+        rng = random.Random(seed)
+        self.paragraphs = [paragraph(rng) for i in range(size)]
+
+    def paragraph(self, rng=None):
+        """
+        Returns one of the paragraphs of the pool, without copying it
+        """
+        return (rng or random).choice(self.paragraphs)
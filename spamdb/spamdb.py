@@ -1,23 +1,85 @@
 import peewee
 import datetime
 import decimal
-import lorem_ipsum
+import functools
+import hashlib
+import os
 import random
+import sys
+import timeit
+
+from . import checkpoint as checkpoints
+from . import export
+from . import lorem_ipsum
+from . import sql
+from .connections import ConnectionPool, QueryCounter, Transactions,\
+    WritePolicy, SEEDING_PRAGMAS
+from .distributions import Distribution, Uniform, Zipf, FixedPerParent
+from .lorem_ipsum import TextPool
 
 __all__ = ['SUPER_GLOBAL_HANDLERS', 'super_global_handler', '_decorate',
+           'SUPER_GLOBAL_COLUMN_HANDLERS', 'super_global_column_handler',
            'Spamdb', 'spam_charfield', 'spam_textfield', 'spam_datetimefield',
            'spam_floatfield', 'spam_doublefield', 'spam_bigintegerfield',
            'spam_decimalfield', 'spam_primarykeyfield', 'spam_timefield',
            'spam_integerfield', 'spam_booleanfield', 'spam_datefield',
-           'spam_foreignkeyfield', 'spam_choices']
+           'spam_foreignkeyfield', 'spam_choices', 'KeyPool',
+           'spam_primarykeycolumn', 'spam_integercolumn', 'spam_floatcolumn',
+           'spam_bigintegercolumn', 'spam_decimalcolumn', 'spam_booleancolumn',
+           'spam_datetimecolumn', 'spam_datecolumn', 'spam_timecolumn',
+           'SpamRandom', 'seedable', 'UniqueIndex', 'Distribution', 'Uniform',
+           'Zipf', 'FixedPerParent', 'text_handler', 'TextPool',
+           'WritePolicy', 'ConnectionPool', 'SEEDING_PRAGMAS']
 
 SUPER_GLOBAL_HANDLERS = {}  # will hold all spam functions for every field type
+SUPER_GLOBAL_COLUMN_HANDLERS = {}  # same, for functions spamming n values
+
+MAX_INSERT_PARAMS = 999  # sqlite's default limit of host parameters per query
+
+DEFAULT_BATCH_SIZE = 1000  # used by run() when spamming with many workers
+
+MAX_UNIQUE_ATTEMPTS = 100  # times a duplicated unique value is regenerated
+
+_timer = timeit.default_timer  # the most precise clock of the platform
 
 
 def super_global_handler(field_name):
     return _decorate(field_name, SUPER_GLOBAL_HANDLERS)
 
 
+def super_global_column_handler(field_name):
+    return _decorate(field_name, SUPER_GLOBAL_COLUMN_HANDLERS)
+
+
+def _installed(name):
+    """
+    Tells whether a module can be imported, without importing it
+    """
+    if name in sys.modules:
+        return sys.modules[name] is not None
+    try:
+        from importlib.util import find_spec
+    except ImportError:  # Python 2
+        import imp
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return False
+        return True
+    return find_spec(name) is not None
+
+
+def _numpy_column_handler(field_name):
+    """
+    Registers a NumPy backed column handler, as long as NumPy is installed.
+    Otherwise the regular handler for the field type gets called n times.
+    NumPy itself is imported the first time a column handler is called.
+    """
+    if not _installed('numpy'):
+        return lambda f: f
+    return super_global_column_handler(field_name)
+
+
 def _decorate(key, container):
     """
     Decorator user to register function handlers on a given
@@ -29,70 +91,169 @@ def _decorate(key, container):
     return fn
 
 
+class SpamRandom(random.Random):
+    """
+    A random.Random that also holds the reference time date handlers spam
+    values before. If now is None, the current time is used instead.
+    """
+
+    def __init__(self, seed=None, now=None):
+        random.Random.__init__(self, seed)
+        self.now = now
+
+    def current_datetime(self):
+        return self.now or datetime.datetime.now()
+
+    def current_date(self):
+        return self.now.date() if self.now else datetime.date.today()
+
+
+_random = SpamRandom()  # used by the handlers when no rng is given
+
+
+def seedable(f):
+    """
+    Marks a handler as taking an rng keyword argument. Spamdb instances pass
+    it a SpamRandom of their own, so spammed values can be reproduced.
+    """
+    f.seedable = True
+    return f
+
+
+def _numpy_random(rng):
+    """
+    Returns a NumPy random generator seeded from a SpamRandom
+    """
+    import numpy
+    return numpy.random.RandomState(rng.getrandbits(32))
+
+
 @super_global_handler(peewee.CharField)
-def spam_charfield(model, field_type, field_name):
+@seedable
+def spam_charfield(model, field_type, field_name, rng=None):
     """
     Returns a random lorem ipsum sentence that does not overpass the
     field's max_length attribute
     """
-    max_length = getattr(model, field_name).attributes['max_length']
-    words = lorem_ipsum.sentence()
-    if max_length < len(words):
-        return words[:max_length].strip()
-    return words
+    field = getattr(model, field_name)
+    max_length = field.attributes['max_length']
+    if _is_unique(model, field):
+        # the cache of short sentences would run out of distinct values
+        return lorem_ipsum.sentence(max_length, rng or _random)
+    return lorem_ipsum.short_sentence(max_length, rng or _random)
 
 
 @super_global_handler(peewee.TextField)
-def spam_textfield(model, field_type, field_name):
+@seedable
+def spam_textfield(model, field_type, field_name, rng=None):
     """
     Return a random number between 1 and 10 of lorem ipsum paragraphs
     """
-    return '.\n\n'.join(lorem_ipsum.paragraphs(random.randrange(1, 10)))
+    rng = rng or _random
+    return '.\n\n'.join(lorem_ipsum.paragraphs(rng.randrange(1, 10),
+                                                rng=rng))
+
+
+def _pick_size(size, rng):
+    """
+    Returns size if it is a number, a random number between the bounds of
+    a (min, max) tuple or the number returned by size(rng) if callable
+    """
+    if callable(size):
+        return size(rng)
+    if isinstance(size, tuple):
+        return rng.randint(*size)
+    return size
+
+
+def text_handler(paragraphs=(1, 9), length=None, pool=None):
+    """
+    Returns a TextField handler spamming texts of `paragraphs` paragraphs,
+    or of `length` characters if given, cutting the last paragraph. Both
+    can be a number, a (min, max) tuple or a function taking a
+    random.Random and returning a number.
+    If pool is a lorem_ipsum.TextPool, paragraphs are taken from it instead
+    of generated, and single paragraph texts are not even copied.
+            Example usage:
+            sdb.global_handler(peewee.TextField)(
+                text_handler(length=(100, 4000), pool=TextPool()))
+    """
+    new_paragraph = pool.paragraph if pool is not None else \
+        lorem_ipsum.paragraph
+
+    @seedable
+    def spam_text(model, field_type, field_name, rng=None):
+        rng = rng or _random
+        if length is None:
+            count = _pick_size(paragraphs, rng)
+            if count == 1:
+                return new_paragraph(rng)
+            return u'\n\n'.join([new_paragraph(rng) for i in range(count)])
+
+        size = _pick_size(length, rng)
+        texts = []
+        missing = size
+        while missing > 0:
+            texts.append(new_paragraph(rng))
+            missing -= len(texts[-1]) + 2
+        return u'\n\n'.join(texts)[:size]
+    return spam_text
 
 
 @super_global_handler(peewee.DateTimeField)
-def spam_datetimefield(model, field_type, field_name):
+@seedable
+def spam_datetimefield(model, field_type, field_name, rng=None):
     """
     Return a random date between now and two months ago.
     Consider days and time.
     """
-    minutes = random.randint(0, 86400)  # 2 months ~= 60d ~= 1440h ~= 86400min
-    return datetime.datetime.now() - datetime.timedelta(minutes=minutes)
+    rng = rng or _random
+    minutes = rng.randint(0, 86400)  # 2 months ~= 60d ~= 1440h ~= 86400min
+    return rng.current_datetime() - datetime.timedelta(minutes=minutes)
 
 
 @super_global_handler(peewee.IntegerField)
-def spam_integerfield(model, field_type, field_name):
-    return random.randint(-10000, 10000)
+@seedable
+def spam_integerfield(model, field_type, field_name, rng=None):
+    return (rng or _random).randint(-10000, 10000)
 
 
 @super_global_handler(peewee.BooleanField)
-def spam_booleanfield(model, field_type, field_name):
-    return bool(random.randint(0, 1))
+@seedable
+def spam_booleanfield(model, field_type, field_name, rng=None):
+    return bool((rng or _random).randint(0, 1))
 
 
 @super_global_handler(peewee.FloatField)
-def spam_floatfield(model, field_type, field_name):
-    num1 = float(random.randint(-10000, 10000))
-    num2 = random.randint(1, 10000)
+@seedable
+def spam_floatfield(model, field_type, field_name, rng=None):
+    rng = rng or _random
+    num1 = float(rng.randint(-10000, 10000))
+    num2 = rng.randint(1, 10000)
     return num1 / num2
 
 
 @super_global_handler(peewee.DoubleField)
-def spam_doublefield(model, field_type, field_name):
-    return spam_floatfield(model, field_type, field_name)
+@seedable
+def spam_doublefield(model, field_type, field_name, rng=None):
+    return spam_floatfield(model, field_type, field_name, rng)
 
 
 @super_global_handler(peewee.BigIntegerField)
-def spam_bigintegerfield(model, field_type, field_name):
+@seedable
+def spam_bigintegerfield(model, field_type, field_name, rng=None):
     """
     Return a random int between +-10 million
     """
-    return random.randint(-10000000000, 10000000000)  # 10 ** 10 = 10 million
+    # 10 ** 10 = 10 million
+    return (rng or _random).randint(-10000000000, 10000000000)
 
 
 @super_global_handler(peewee.DecimalField)
-def spam_decimalfield(model, field_type, field_name):
-    return decimal.Decimal(random.random() + random.randint(-10000, 10000))
+@seedable
+def spam_decimalfield(model, field_type, field_name, rng=None):
+    rng = rng or _random
+    return decimal.Decimal(rng.random() + rng.randint(-10000, 10000))
 
 
 @super_global_handler(peewee.PrimaryKeyField)
@@ -104,52 +265,610 @@ def spam_primarykeyfield(model, field_type, field_name):
 def spam_foreignkeyfield(model, field_type, field_name):
     related_model = getattr(model, field_name).rel_model
     query = related_model.select().order_by(peewee.fn.Random()).limit(1)
-    if query.count():
-        return [model for model in query][0]
+    for related in query:
+        return related
 
 
 @super_global_handler(peewee.DateField)
-def spam_datefield(model, field_type, field_name):
+@seedable
+def spam_datefield(model, field_type, field_name, rng=None):
     """
     Return a random date between now and two months ago.
     Consider days only.
     """
-    random_days = random.randrange(0, 60)
-    return datetime.date.today() - datetime.timedelta(days=random_days)
+    rng = rng or _random
+    random_days = rng.randrange(0, 60)
+    return rng.current_date() - datetime.timedelta(days=random_days)
 
 
 @super_global_handler(peewee.TimeField)
-def spam_timefield(model, field_type, field_name):
-    hour = random.randint(0, 23)
-    minute = random.randint(0, 59)
-    second = random.randint(0, 59)
+@seedable
+def spam_timefield(model, field_type, field_name, rng=None):
+    rng = rng or _random
+    hour = rng.randint(0, 23)
+    minute = rng.randint(0, 59)
+    second = rng.randint(0, 59)
     return datetime.time(hour=hour, minute=minute, second=second)
 
 
-def spam_choices(model, field_type, field_name):
+@seedable
+def spam_choices(model, field_type, field_name, rng=None):
     choices = getattr(model, field_name).choices
-    return random.choice(choices)
+    return (rng or _random).choice(choices)
+
+
+@super_global_column_handler(peewee.PrimaryKeyField)
+def spam_primarykeycolumn(model, field_type, field_name, n):
+    return [None] * n
+
+
+@_numpy_column_handler(peewee.IntegerField)
+@seedable
+def spam_integercolumn(model, field_type, field_name, n, rng=None):
+    return _numpy_random(rng or _random).randint(-10000, 10001, n).tolist()
+
+
+@_numpy_column_handler(peewee.BigIntegerField)
+@seedable
+def spam_bigintegercolumn(model, field_type, field_name, n, rng=None):
+    import numpy
+    return _numpy_random(rng or _random).randint(
+        -10000000000, 10000000001, n, dtype=numpy.int64).tolist()
+
+
+@_numpy_column_handler(peewee.BooleanField)
+@seedable
+def spam_booleancolumn(model, field_type, field_name, n, rng=None):
+    return _numpy_random(rng or _random).randint(0, 2, n).astype(
+        bool).tolist()
+
 
+@_numpy_column_handler(peewee.FloatField)
+@_numpy_column_handler(peewee.DoubleField)
+@seedable
+def spam_floatcolumn(model, field_type, field_name, n, rng=None):
+    state = _numpy_random(rng or _random)
+    num1 = state.randint(-10000, 10001, n).astype(float)
+    num2 = state.randint(1, 10001, n)
+    return (num1 / num2).tolist()
 
-def _coin_toss():
+
+@_numpy_column_handler(peewee.DecimalField)
+@seedable
+def spam_decimalcolumn(model, field_type, field_name, n, rng=None):
+    state = _numpy_random(rng or _random)
+    nums = state.random_sample(n) + state.randint(-10000, 10001, n)
+    return [decimal.Decimal(num) for num in nums.tolist()]
+
+
+@_numpy_column_handler(peewee.DateTimeField)
+@seedable
+def spam_datetimecolumn(model, field_type, field_name, n, rng=None):
+    """
+    Return n random dates between now and two months ago.
+    Consider days and time.
+    """
+    import numpy
+    rng = rng or _random
+    minutes = _numpy_random(rng).randint(0, 86401, n)
+    now = numpy.datetime64(rng.current_datetime())
+    return (now - minutes.astype('timedelta64[m]')).tolist()
+
+
+@_numpy_column_handler(peewee.DateField)
+@seedable
+def spam_datecolumn(model, field_type, field_name, n, rng=None):
+    """
+    Return n random dates between now and two months ago.
+    Consider days only.
+    """
+    import numpy
+    rng = rng or _random
+    days = _numpy_random(rng).randint(0, 60, n)
+    today = numpy.datetime64(rng.current_date())
+    return (today - days.astype('timedelta64[D]')).tolist()
+
+
+@_numpy_column_handler(peewee.TimeField)
+@seedable
+def spam_timecolumn(model, field_type, field_name, n, rng=None):
+    seconds = _numpy_random(rng or _random).randint(0, 86400, n).tolist()
+    return [datetime.time(hour=s // 3600, minute=s // 60 % 60, second=s % 60)
+            for s in seconds]
+
+
+def _coin_toss(rng=None):
     """
     Used to ignore or not a nullable field
     """
-    return bool(random.randint(0, 1))
+    return (rng or _random).random() < 0.5
+
+
+def _insert_many(model, rows):
+    """
+    Persists a list of attribute dicts with multi-row INSERT statements.
+    All the dicts are expected to have the same keys.
+    """
+    fields = [model._meta.fields[name] for name in rows[0]] if rows else []
+    if not fields:
+        for row in rows:
+            model.insert(**row).execute()
+        return
+
+    # statements are kept under the limit of host parameters
+    step = max(1, MAX_INSERT_PARAMS // len(fields))
+
+    if hasattr(model, 'insert_many'):  # peewee >= 2.2
+        for start in range(0, len(rows), step):
+            model.insert_many(rows[start:start + step]).execute()
+        return
+
+    db = model._meta.database
+    qc = db.compiler()
+    columns = ', '.join(qc.quote(field.db_column) for field in fields)
+    values = '(%s)' % ', '.join([db.interpolation] * len(fields))
+
+    for start in range(0, len(rows), step):
+        chunk = rows[start:start + step]
+        params = [field.db_value(row[field.name])
+                  for row in chunk for field in fields]
+        sql = 'INSERT INTO %s (%s) VALUES %s' % (
+            qc.quote(model._meta.db_table), columns,
+            ', '.join([values] * len(chunk)))
+        db.execute_sql(sql, params)
+
+
+def _derive_seed(seed, *keys):
+    """
+    Returns a 32 bit seed derived from a seed and the given keys, used to
+    give independent random streams to each model and worker.
+    Returns None if seed is None.
+    """
+    if seed is None:
+        return None
+    digest = hashlib.md5(repr((seed,) + keys).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16)
+
+
+_worker_spamdb = None  # the Spamdb instance inherited by worker processes
+
+
+def _init_worker():
+    """
+    Opens new connections in a worker process, so it does not share the
+    ones inherited from its parent
+    """
+    _worker_spamdb.connections.connect(reopen=True)
+    _worker_spamdb.progress = None  # the parent reports each shard
+    for pool in _worker_spamdb.key_pools.values():
+        pool.invalidate()
+
+
+def _run_shard(shard):
+    """
+    Spams a shard of rows of a model in a worker process.
+    Returns the position of the model, the number of rows inserted and the
+    counters collected for the shard, if profiling.
+    """
+    position, index, size = shard
+    _worker_spamdb.reseed(position, index)
+    model = _worker_spamdb[position]
+    if _worker_spamdb.profile:
+        _worker_spamdb.reset_stats()
+    rows = _worker_spamdb.spam_rows(model, size)
+    count = _worker_spamdb.insert_rows(model, rows)
+    return position, count, _worker_spamdb._shard_stats()
+
+
+class KeyPool(object):
+    """
+    Holds the primary keys of a model in memory, so random foreign key
+    values can be picked without querying the database for every row.
+    """
+
+    def __init__(self, model, keys=None):
+        """
+        If keys is given, the pool holds those keys and the ones added
+        later instead of the ones in the database
+        """
+        self.model = model
+        self.keys = list(keys or [])
+        self.last_key = max(self.keys) if self.keys else None
+        self.loaded = keys is not None
+        self.stale = keys is None
+        self.hits = 0  # keys sampled from memory
+        self.misses = 0  # keys sampled after refreshing the pool
+
+    def add(self, key):
+        """
+        Registers the primary key of a row just saved
+        """
+        if self.loaded and not self.stale and key is not None:
+            self.keys.append(key)
+            if self.last_key is None or key > self.last_key:
+                self.last_key = key
+
+    def invalidate(self):
+        """
+        Marks the pool to be refreshed before picking the next key
+        """
+        self.stale = True
+
+    def reset(self):
+        """
+        Forgets the keys, so the pool is reloaded from scratch before
+        picking the next key, without the keys of deleted rows
+        """
+        self.keys = []
+        self.last_key = None
+        self.stale = True
+
+    def refresh(self):
+        """
+        Streams the primary keys from the database. Auto incremented keys
+        are fetched incrementally, other keys are reloaded from scratch.
+        """
+        pk = self.model._meta.primary_key
+        query = self.model.select(pk).order_by(pk).tuples()
+
+        if not self.model._meta.auto_increment:
+            self.keys = []
+        elif self.last_key is not None:
+            query = query.where(pk > self.last_key)
+
+        for row in query.iterator():
+            self.keys.append(row[0])
+            self.last_key = row[0]
+
+        self.loaded = True
+        self.stale = False
+
+    def current_keys(self):
+        """
+        Returns the list of keys, refreshing the pool first if stale
+        """
+        if self.stale:
+            self.refresh()
+        return self.keys
+
+    def sample(self, rng=None, distribution=None):
+        """
+        Returns a random primary key, picked following a Distribution
+        (uniformly if None), or None if the table is empty
+        """
+        if self.stale:
+            self.misses += 1
+            self.refresh()
+        else:
+            self.hits += 1
+        if self.keys:
+            if distribution is None:
+                return (rng or _random).choice(self.keys)
+            return distribution.sample(self.keys, rng or _random)
+
+
+def _is_unique(model, field):
+    """
+    Tells whether the values of a field must be unique on their own: the
+    field is unique, a primary key not auto incremented or the only column
+    of a unique index. See _unique_field_names.
+    """
+    if field.unique or (field.primary_key and
+                        not model._meta.auto_increment):
+        return True
+    return any(unique and len(fields) == 1 and
+               getattr(fields[0], 'name', fields[0]) == field.name
+               for fields, unique in model._meta.indexes)
+
+
+def _unique_field_names(model):
+    """
+    Returns a tuple of field names for each unique field and each unique
+    multi column index of a model. Auto incremented primary keys are left
+    out, the database assigns them.
+    """
+    uniques = []
+    for field in model._meta.get_fields():
+        if field.unique or (field.primary_key and
+                            not model._meta.auto_increment):
+            uniques.append((field.name,))
+    for fields, unique in model._meta.indexes:
+        if unique:
+            uniques.append(tuple(getattr(f, 'name', f) for f in fields))
+    return uniques
+
+
+class UniqueIndex(object):
+    """
+    Remembers the hashes of the values spammed for a unique field, or for a
+    unique index of many fields, so duplicates can be regenerated before
+    they reach the database. Only hashes are kept, which bounds the memory
+    used for long text values; a hash collision just makes a row be
+    spammed again.
+    """
+
+    def __init__(self, model, field_names):
+        self.model = model
+        self.field_names = field_names
+        self.seen = set()
+        self.loaded = False
+
+    def key(self, values):
+        """
+        Returns the hash of a tuple of values, or None if any of them is
+        NULL, as NULLs never violate unique constraints
+        """
+        values = tuple(v.get_id() if isinstance(v, peewee.Model) else v
+                       for v in values)
+        if None in values:
+            return None
+        return hash(values)
+
+    def contains(self, attrs):
+        """
+        Tells whether the values of a dict as returned by spam_fields were
+        already seen
+        """
+        key = self.key([attrs.get(name) for name in self.field_names])
+        return key is not None and key in self.seen
+
+    def add(self, attrs):
+        """
+        Registers the values of a dict as returned by spam_fields
+        """
+        key = self.key([attrs.get(name) for name in self.field_names])
+        if key is not None:
+            self.seen.add(key)
+
+    def preload(self):
+        """
+        Streams the values already in the database in a single query
+        """
+        fields = [getattr(self.model, name) for name in self.field_names]
+        for row in self.model.select(*fields).tuples().iterator():
+            key = self.key(row)
+            if key is not None:
+                self.seen.add(key)
+        self.loaded = True
 
 
 class Spamdb(list):
 
-    def __init__(self, *args):
+    def __init__(self, *args, **kwargs):
         # allow passing models as positional arguments
         # so it is possible to do s = Spamdb(model, another_model)
+        self.counts = {}  # rows spammed by run() for some models
         for a in args:
             self.append(a)
 
+        # collects the counters returned by stats() if True
+        self.profile = kwargs.pop('profile', False)
+        self.timings = {}
+        self.queries = 0
+        self.pool_counts = [0, 0]  # key pool hits and misses of workers
+        # callables called with the event, name and seconds of each timing
+        self.hooks = []
+        # callable called as progress(model, n) with the rows spammed for a
+        # model as they are, whether profiling or not
+        self.progress = kwargs.pop('progress', None)
+
+        # seeds the random streams of each model, so runs can be reproduced
+        self.seed = kwargs.pop('seed', None)
+        # reference time for date handlers, the start of each run if None
+        self.now = kwargs.pop('now', None)
+        self.run_now = None
+        self.randoms = {}
+        self.seed_keys = ()
+
+        # when run() commits, after every row or batch if None
+        self.write_policy = kwargs.pop('write_policy', None)
+        # pragmas of the SQLite connections of a run, e.g. SEEDING_PRAGMAS
+        self.sqlite_pragmas = kwargs.pop('sqlite_pragmas', None)
+        if kwargs:
+            raise TypeError('Spamdb got unexpected keyword arguments: %s' %
+                            ', '.join(sorted(kwargs)))
+        # the ConnectionPool and Transactions of the run in progress
+        self.connections = None
+        self.transactions = None
+
         # used to register custom handler for fields
         self.global_handlers = dict(SUPER_GLOBAL_HANDLERS)
         self.strict_handlers = {}
 
+        # used to register custom handlers spamming a whole column at once
+        self.global_column_handlers = dict(SUPER_GLOBAL_COLUMN_HANDLERS)
+        self.strict_column_handlers = {}
+
+        # compiled spam plans, one for each model
+        self.plans = {}
+
+        # foreign keys left out of the plans while run() breaks a cycle
+        self.deferred = {}
+
+        # values spammed for unique fields and indexes, for each model
+        self.unique_indexes = {}
+
+        # primary keys of related models, used to spam foreign keys
+        self.key_pools = {}
+        # distributions of the foreign keys among the related rows
+        self.fan_outs = {}
+        # join models spammed as distinct pairs of related rows
+        self.links = {}
+        # self-referential models spammed as trees, level by level
+        self.trees = {}
+        fk_handler = self.global_handlers.get(peewee.ForeignKeyField)
+        if fk_handler is spam_foreignkeyfield:
+            self.global_handlers[peewee.ForeignKeyField] = \
+                self.spam_foreignkeyfield
+
+    def append(self, model, count=None):
+        """
+        Adds a model to be spammed. If count is given, run() spams that
+        many rows of the model instead of one per iteration.
+        """
+        super(Spamdb, self).append(model)
+        if count is not None:
+            self.counts[model] = count
+
+    def fan_out(self, field, distribution):
+        """
+        Sets the Distribution followed to spread the rows of a model among
+        the rows a foreign key field points to, e.g.
+        sdb.fan_out(Comment.blog, Zipf(1.2))
+        """
+        self.fan_outs[field] = distribution
+
+    def link(self, model, degree, left=None, right=None):
+        """
+        Spams a join model as distinct (left, right) pairs of related rows
+        instead of one row per iteration: each row the `left` foreign key
+        points to is linked to `degree` distinct rows of the `right` one,
+        picked following the distribution given to fan_out for `right`, if
+        any. degree can be a number, a (min, max) tuple or a function
+        taking a random.Random and returning a number. left and right
+        default to the first and second foreign keys of the model.
+        Raises ValueError if the model does not have two foreign keys.
+                Example usage:
+                sdb.link(models.Relationship, degree=(0, 50))
+        """
+        if left is None or right is None:
+            foreign_keys = [field for field in model._meta.get_fields()
+                            if isinstance(field, peewee.ForeignKeyField)]
+            if len(foreign_keys) < 2:
+                raise ValueError('%s needs two foreign keys to be linked' %
+                                 model.__name__)
+            left = left or foreign_keys[0]
+            right = right or foreign_keys[1]
+        self.links[model] = (left, right, degree)
+
+    def tree(self, model, depth, branching, field=None):
+        """
+        Spams a self-referential model as trees `depth` levels deep instead
+        of independent rows: the rows run() would spam for the model are
+        the roots, and each row of a level gets `branching` children, a
+        number, a (min, max) tuple or a function taking a random.Random and
+        returning a number. field is the nullable foreign key pointing to
+        the parent row, the first one pointing to the model by default.
+                Example usage:
+                sdb.tree(models.Category, depth=4, branching=(1, 5))
+        """
+        if field is None:
+            fields = [field for field in model._meta.get_fields()
+                      if isinstance(field, peewee.ForeignKeyField) and
+                      field.rel_model is model]
+            if not fields:
+                raise ValueError('%s has no foreign key to itself' %
+                                 model.__name__)
+            field = fields[0]
+        if not field.null:
+            raise ValueError('%s.%s must be nullable to spam the roots' % (
+                model.__name__, field.name))
+        self.trees[model] = (field, depth, branching)
+
+    def add_hook(self, hook):
+        """
+        Registers a function called as hook(event, name, seconds) for every
+        handler call ('handler', 'Model.field'), model construction
+        ('construct', 'Model'), save ('save', 'Model') and multi-row insert
+        ('insert', 'Model') of a profiling Spamdb
+        """
+        self.hooks.append(hook)
+
+    def stats(self):
+        """
+        Returns the counters collected since the Spamdb was created with
+        profile=True, or since reset_stats: the calls and seconds of each
+        event, by event and name, the rows spammed for each model, the
+        queries run by run() and the hits and misses of the key pools.
+        The counters of worker processes are added up once each shard is
+        done; hooks are not called for them.
+        """
+        stats = {'rows': {}, 'queries': self.queries,
+                 'pool_hits': self.pool_counts[0],
+                 'pool_misses': self.pool_counts[1]}
+        for (event, name), (calls, seconds) in self.timings.items():
+            if event == 'rows':
+                stats['rows'][name] = calls
+            else:
+                stats.setdefault(event, {})[name] = {'calls': calls,
+                                                     'seconds': seconds}
+        for pool in self.key_pools.values():
+            stats['pool_hits'] += pool.hits
+            stats['pool_misses'] += pool.misses
+        return stats
+
+    def reset_stats(self):
+        """
+        Sets every counter returned by stats back to zero
+        """
+        self.timings.clear()
+        self.queries = 0
+        self.pool_counts = [0, 0]
+        for pool in self.key_pools.values():
+            pool.hits = pool.misses = 0
+
+    def _shard_stats(self):
+        """
+        Returns the counters of a worker process to be merged by its
+        parent, or None unless profiling
+        """
+        if not self.profile:
+            return None
+        pools = self.key_pools.values()
+        return (self.timings, self.queries,
+                (sum(pool.hits for pool in pools),
+                 sum(pool.misses for pool in pools)))
+
+    def _merge_stats(self, shard_stats):
+        """
+        Adds up the counters returned by _shard_stats
+        """
+        if shard_stats is None:
+            return
+        timings, queries, pool_counts = shard_stats
+        for key, (calls, seconds) in timings.items():
+            timing = self.timings.setdefault(key, [0, 0.0])
+            timing[0] += calls
+            timing[1] += seconds
+        self.queries += queries
+        self.pool_counts[0] += pool_counts[0]
+        self.pool_counts[1] += pool_counts[1]
+
+    def _spammed(self, model, n):
+        """
+        Counts n rows spammed for a model
+        """
+        if self.profile:
+            self._record('rows', model.__name__, 0.0, n)
+        if self.progress is not None:
+            self.progress(model, n)
+
+    def _record(self, event, name, seconds, calls=1):
+        timing = self.timings.get((event, name), None)
+        if timing is None:
+            timing = self.timings[(event, name)] = [0, 0.0]
+        timing[0] += calls
+        timing[1] += seconds
+        for hook in self.hooks:
+            hook(event, name, seconds)
+
+    def _timed_call(self, event, name, f, *args, **kwargs):
+        start = _timer()
+        result = f(*args, **kwargs)
+        self._record(event, name, _timer() - start)
+        return result
+
+    def _timed(self, f, name):
+        """
+        Wraps a handler to record the time spent by each call
+        """
+        if f is None:
+            return None
+
+        def timed(*args):
+            return self._timed_call('handler', name, f, *args)
+        return timed
+
     def strict_handler(self, field_qname):
         """
         Used to override default behaviour for a custom field in a model
@@ -165,7 +884,7 @@ class Spamdb(list):
                     # called when spamming User.name field
                     return "Hi there!!"
         """
-        return _decorate(field_qname, self.strict_handlers)
+        return self._decorate(field_qname, self.strict_handlers)
 
     def global_handler(self, field_type):
         """
@@ -183,7 +902,39 @@ class Spamdb(list):
                     # called when spamming all peewee.CharField fields
                     return "My custom string"
         """
-        return _decorate(field_type, self.global_handlers)
+        # a column handler for the same type would shadow the new handler
+        self.global_column_handlers.pop(field_type, None)
+        return self._decorate(field_type, self.global_handlers)
+
+    def strict_column_handler(self, field_qname):
+        """
+        Same as strict_handler, for functions taking an extra n argument
+        and returning a sequence of n spammed values
+        """
+        return self._decorate(field_qname, self.strict_column_handlers)
+
+    def global_column_handler(self, field_type):
+        """
+        Same as global_handler, for functions taking an extra n argument
+        and returning a sequence of n spammed values
+                Example usage:
+                @sdb.global_column_handler(peewee.IntegerField):
+                def spam_integercolumn(model, field_type, field_name, n):
+                    return range(n)
+        """
+        return self._decorate(field_type, self.global_column_handlers)
+
+    def _decorate(self, key, container):
+        """
+        Same as _decorate, but also drops the compiled spam plans since
+        they may be using a handler that is being overridden
+        """
+        register = _decorate(key, container)
+
+        def fn(f):
+            self.plans.clear()
+            return register(f)
+        return fn
 
     def get_handler(self, model, field_type, field_name):
         """
@@ -199,35 +950,394 @@ class Spamdb(list):
 
         return handler
 
-    def spam_fields(self, model):
+    def get_column_handler(self, model, field_type, field_name):
         """
-        Iterates through all peewee attrs of a given model and gets the
-        appropiate handler to spam each.
-        Returns a dict of model attributes as keys and the respective spammed
-        content as values.
+        Same as get_handler, for column handlers. A strict handler for
+        the field takes precedence over a global column handler.
+        """
+        key = getattr(model, field_name, None)
+
+        handler = self.strict_column_handlers.get(key, None)
+
+        if not handler and key not in self.strict_handlers:
+            handler = self.global_column_handlers.get(field_type, None)
+
+        return handler
+
+    def random_for(self, model):
+        """
+        Returns the SpamRandom used to spam a given model, seeded from the
+        seed of this instance and the model name
         """
+        rng = self.randoms.get(model, None)
+        if rng is None:
+            rng = self.randoms[model] = SpamRandom(now=self.run_now or
+                                                   self.now)
+            rng.seed(self._model_seed(model))
+        return rng
 
-        attrs = {}  # this dict will hold all spammed attributes
+    def _model_seed(self, model):
+        name = '%s.%s' % (model.__module__, model.__name__)
+        return _derive_seed(self.seed, name, *self.seed_keys)
+
+    def reseed(self, *keys):
+        """
+        Seeds the random stream of every model again, from the seed of this
+        instance, the model name and the given keys. Gives each shard of a
+        parallel run its own stream.
+        """
+        self.seed_keys = keys
+        for model, rng in self.randoms.items():
+            rng.seed(self._model_seed(model))
+
+    def _pin_now(self, now):
+        """
+        Sets the reference time of every model SpamRandom to `now`, or back
+        to the now given to this instance if None
+        """
+        self.run_now = now
+        for rng in self.randoms.values():
+            rng.now = now or self.now
+
+    def key_pool(self, model):
+        """
+        Returns the KeyPool holding the primary keys of a given model
+        """
+        pool = self.key_pools.get(model, None)
+        if pool is None:
+            pool = self.key_pools[model] = KeyPool(model)
+        return pool
+
+    def spam_foreignkeyfield(self, model, field_type, field_name, rng=None):
+        """
+        Returns the primary key of a random related row, picked from the
+        in-memory pool of keys of the related model following the fan-out
+        distribution of the field
+        """
+        field = getattr(model, field_name)
+        return self.key_pool(field.rel_model).sample(
+            rng, self.fan_outs.get(field, None))
+    spam_foreignkeyfield.seedable = True
+
+    def unique_indexes_for(self, model):
+        """
+        Returns the list of UniqueIndex of a given model, empty if the
+        model has no unique fields or indexes
+        """
+        indexes = self.unique_indexes.get(model, None)
+        if indexes is None:
+            indexes = self.unique_indexes[model] = [
+                UniqueIndex(model, names)
+                for names in _unique_field_names(model)]
+        return indexes
+
+    def preload_unique(self, model):
+        """
+        Loads the unique values of a model already in the database, so they
+        are not spammed again
+        """
+        for index in self.unique_indexes_for(model):
+            if not index.loaded:
+                index.preload()
+
+    def make_unique(self, model, attrs):
+        """
+        Spams again the fields of a dict as returned by spam_fields whose
+        values were already spammed for a unique field or index.
+        Every index is checked again after each attempt, as fields may be
+        shared by many indexes, and the values are registered once all of
+        them accept the row.
+        Raises ValueError if no new values are found after
+        MAX_UNIQUE_ATTEMPTS attempts.
+        """
+        indexes = self.unique_indexes_for(model)
+        plan = None
+        attempts = 0
+        while True:
+            clashes = [index for index in indexes if index.contains(attrs)]
+            if not clashes:
+                break
+            attempts += 1
+            if attempts > MAX_UNIQUE_ATTEMPTS:
+                raise ValueError(
+                    'Could not spam unique values for %s.%s' % (
+                        model.__name__, ', '.join(clashes[0].field_names)))
+            if plan is None:
+                plan = dict((entry[0], entry) for entry in
+                            self.spam_plan(model))
+            for name in set(name for index in clashes
+                            for name in index.field_names):
+                if name in plan:
+                    attrs[name] = self._spam_one(*plan[name][2:])
+        for index in indexes:
+            index.add(attrs)
+        return attrs
+
+    def _spam_one(self, handler, params, column_handler):
+        if handler is not None:
+            return handler(*params)
+        return column_handler(*(params + (1,)))[0]
+
+    def compile_plan(self, model):
+        """
+        Iterates through all peewee attrs of a given model and gets the
+        appropiate handlers to spam each.
+        Returns a list of (field_name, nullable, handler, params,
+        column_handler) tuples, leaving out the fields that have no handler
+        and the deferred ones. Seedable handlers get the model SpamRandom.
+        """
+        plan = []
+        deferred = self.deferred.get(model, ())
+        rng = self.random_for(model)
 
         for field_name, field_instance in model._meta.get_sorted_fields():
+            if field_name in deferred:
+                continue
+
             params = (model, field_instance.__class__, field_name)
 
-            if field_instance.null and _coin_toss():
+            if field_instance.choices:
+                handler = spam_choices  # pick a random choice if possible
+                column_handler = None
+            else:
+                # find an appropiate handler
+                handler = self.get_handler(*params)
+                column_handler = self.get_column_handler(*params)
+
+            if getattr(handler, 'seedable', False):
+                handler = functools.partial(handler, rng=rng)
+            if getattr(column_handler, 'seedable', False):
+                column_handler = functools.partial(column_handler, rng=rng)
+
+            if self.profile:
+                name = '%s.%s' % (model.__name__, field_name)
+                handler = self._timed(handler, name)
+                column_handler = self._timed(column_handler, name)
+
+            if handler is not None or column_handler is not None:
+                plan.append((field_name, field_instance.null, handler, params,
+                             column_handler))
+
+        return plan
+
+    def spam_plan(self, model):
+        """
+        Returns the compiled spam plan of a model, compiling it the first
+        time. Plans are dropped whenever a handler is registered through
+        strict_handler or global_handler; call plans.clear() after
+        changing the handler dicts by hand.
+        """
+        plan = self.plans.get(model, None)
+        if plan is None:
+            plan = self.plans[model] = self.compile_plan(model)
+        return plan
+
+    def spam_fields(self, model):
+        """
+        Spams every field of a given model following its spam plan.
+        Returns a dict of model attributes as keys and the respective spammed
+        content as values. Values of unique fields and indexes are never
+        repeated, see make_unique.
+        """
+
+        attrs = {}  # this dict will hold all spammed attributes
+        rng = self.random_for(model)
+
+        for field_name, nullable, handler, params, _ in self.spam_plan(model):
+            if nullable and _coin_toss(rng):
                 continue  # the field can be null and it was randomly skipped
+            if handler is None:
+                continue  # there is only a column handler for the field
+            attrs[field_name] = handler(*params)
+
+        if self.unique_indexes_for(model):
+            self.make_unique(model, attrs)
+
+        self._spammed(model, 1)
+        return attrs
+
+    def spam_rows(self, model, n):
+        """
+        Spams n rows of a given model one column at a time, calling the
+        column handler of each field once, or its handler once per row if
+        there is no column handler. Nullable fields left NULL get no value
+        spammed.
+        Returns a list of n dicts as returned by spam_fields.
+        """
+        rows = [{} for i in range(n)]
+        rng = self.random_for(model)
+
+        for field_name, nullable, handler, params, column_handler in \
+                self.spam_plan(model):
+            # values are only spammed for the rows the field is not NULL,
+            # as spam_fields does, which stateful handlers rely on
+            targets = rows
+            if nullable:
+                targets = [attrs for attrs in rows if not _coin_toss(rng)]
+            if not targets:
+                continue
+            if column_handler is not None:
+                values = column_handler(*(params + (len(targets),)))
             else:
-                # otherwise the field can not be null
-                # or can be null but was randomly set to have a value
+                values = [handler(*params) for i in range(len(targets))]
+
+            for attrs, value in zip(targets, values):
+                attrs[field_name] = value
+
+        if self.unique_indexes_for(model):
+            for attrs in rows:
+                self.make_unique(model, attrs)
+
+        self._spammed(model, n)
+        return rows
+
+    def iter_batches(self, model, batch_size=DEFAULT_BATCH_SIZE, n=None):
+        """
+        Generator of lists of at most batch_size dicts as returned by
+        spam_rows, up to n rows in total, or forever if n is None.
+        Nothing is saved to the database.
+        """
+        done = 0
+        while n is None or done < n:
+            size = batch_size if n is None else min(batch_size, n - done)
+            yield self.spam_rows(model, size)
+            done += size
 
-                if field_instance.choices:
-                    handler = spam_choices  # pick a random choice if possible
+    def iter_rows(self, model, n=None, tuples=False,
+                  batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Generator of n spammed rows of a given model, or endless if n is
+        None, spammed batch_size at a time. Rows are dicts as returned by
+        spam_fields, or tuples following model._meta.get_field_names(),
+        holding None for the fields left null, if tuples is True.
+        Nothing is saved to the database.
+        """
+        names = model._meta.get_field_names()
+        for rows in self.iter_batches(model, batch_size, n):
+            for attrs in rows:
+                if tuples:
+                    yield tuple(attrs.get(name) for name in names)
                 else:
-                    # find an appropiate handler
-                    handler = self.get_handler(*params)
+                    yield attrs
 
-                attr_value = handler(*params)
-                attrs.update({field_name: attr_value})
+    def iter_links(self, model, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Generator of lists of at most batch_size dicts, as returned by
+        spam_rows, linking the rows of the related models of a model
+        registered with link. Pairs already spammed for a unique index of
+        the model are left out. Nothing is saved to the database.
+        """
+        left, right, degree = self.links[model]
+        rng = self.random_for(model)
+        left_keys = self.key_pool(left.rel_model).current_keys()
+        right_keys = self.key_pool(right.rel_model).current_keys()
+        distribution = self.fan_outs.get(right, None)
+        # rows are not linked to themselves, one more pick covers for it
+        extra = 1 if left.rel_model is right.rel_model else 0
+        indexes = [index for index in self.unique_indexes_for(model)
+                   if set(index.field_names) <= set([left.name, right.name])]
 
-        return attrs
+        pairs = []
+        for left_key in left_keys:
+            count = min(_pick_size(degree, rng), len(right_keys) - extra)
+            if count <= 0:
+                continue
+            if distribution is None:
+                picks = rng.sample(right_keys,
+                                   min(count + extra, len(right_keys)))
+            else:
+                # distributions pick with replacement, retry the repeated
+                picks = set()
+                for attempt in range((count + extra) * 10):
+                    picks.add(distribution.sample(right_keys, rng))
+                    if len(picks) >= count + extra:
+                        break
+            for right_key in picks:
+                if count == 0:
+                    break
+                if extra and right_key == left_key:
+                    continue
+                pairs.append((left_key, right_key))
+                count -= 1
+            if len(pairs) >= batch_size:
+                for batch in self._link_batches(model, left, right, indexes,
+                                                pairs, batch_size):
+                    yield batch
+                pairs = []
+
+        for batch in self._link_batches(model, left, right, indexes, pairs,
+                                        batch_size):
+            yield batch
+
+    def _link_batches(self, model, left, right, indexes, pairs, batch_size):
+        """
+        Spams the fields of a linked model other than left and right for a
+        list of pairs, yielding batch_size rows at a time
+        """
+        for start in range(0, len(pairs), batch_size):
+            rows = []
+            for left_key, right_key in pairs[start:start + batch_size]:
+                attrs = {left.name: left_key, right.name: right_key}
+                if not any(index.contains(attrs) for index in indexes):
+                    for index in indexes:
+                        index.add(attrs)
+                    rows.append(attrs)
+            spammed = self._spam_rows_except(model, [left.name, right.name],
+                                             len(rows))
+            for attrs, values in zip(rows, spammed):
+                attrs.update(values)
+            if rows:
+                yield rows
+
+    def iter_tree(self, model, roots, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Generator of lists of at most batch_size dicts, as returned by
+        spam_rows, spamming a model registered with tree one level after
+        the other: `roots` rows without a parent, then the children of each
+        row of the previous level. The keys of a level are taken from the
+        key pool of the model, or from the spammed rows if the primary key
+        is not auto incremented, so each batch must be saved before asking
+        for the next one. Nothing is saved to the database by itself.
+        """
+        field, depth, branching = self.trees[model]
+        rng = self.random_for(model)
+        pool = self.key_pool(model)
+        pk_name = model._meta.primary_key.name
+        auto_increment = model._meta.auto_increment
+
+        parents = [None] * roots  # the parent of each row of the level
+        for level in range(depth):
+            known = len(pool.current_keys())
+            keys = []
+            for start in range(0, len(parents), batch_size):
+                chunk = parents[start:start + batch_size]
+                rows = self._spam_rows_except(model, [field.name],
+                                              len(chunk))
+                for attrs, parent in zip(rows, chunk):
+                    attrs[field.name] = parent
+                    if not auto_increment:
+                        keys.append(attrs.get(pk_name))
+                yield rows
+            if auto_increment:
+                keys = pool.current_keys()[known:]
+            parents = [key for key in keys
+                       for i in range(_pick_size(branching, rng))]
+
+    def _spam_rows_except(self, model, field_names, n):
+        """
+        Spams n rows like spam_rows, leaving out the fields named
+        """
+        deferred = self.deferred.get(model, None)
+        self.deferred[model] = set(deferred or ()) | set(field_names)
+        self.plans.pop(model, None)
+        try:
+            return self.spam_rows(model, n)
+        finally:
+            if deferred is None:
+                self.deferred.pop(model, None)
+            else:
+                self.deferred[model] = deferred
+            self.plans.pop(model, None)
 
     def spam_model(self, model, save=False):
         """
@@ -236,13 +1346,778 @@ class Spamdb(list):
         before returning it.
         """
         attributes = self.spam_fields(model)  # get spammed fields
-        obj = model(**attributes)
+        if self.profile:
+            obj = self._timed_call('construct', model.__name__, model,
+                                   **attributes)
+        else:
+            obj = model(**attributes)
         if save:
-            obj.save()
+            if self.profile:
+                self._timed_call('save', model.__name__, obj.save)
+            else:
+                obj.save()
+            if model in self.key_pools:
+                self.key_pools[model].add(obj.get_id())
+            self._wrote(1)
         return obj
 
-    def run(self, iterations=1):
-        """Iterates through all models"""
-        for i in range(0, iterations):
-            for model in self.__iter__():
-                self.spam_model(model, save=True)
+    def insert_rows(self, model, rows):
+        """
+        Persists a list of dicts as returned by spam_fields using multi-row
+        INSERTs inside a single transaction.
+        Fields left out of a dict get their default value, or NULL.
+        Returns the number of inserted rows.
+        """
+        pk = model._meta.primary_key
+        names = set()
+        prepared = []
+
+        for attrs in rows:
+            data = model._meta.get_default_dict()
+            data.update(attrs)
+            if data.get(pk.name) is None:
+                data.pop(pk.name, None)  # let the database assign it
+            names.update(data)
+            prepared.append(data)
+
+        for data in prepared:
+            for name in names:
+                data.setdefault(name, None)
+
+        with model._meta.database.transaction():
+            if self.profile:
+                self._timed_call('insert', model.__name__, _insert_many,
+                                 model, prepared)
+            else:
+                _insert_many(model, prepared)
+
+        if model in self.key_pools:
+            self.key_pools[model].invalidate()
+
+        self._wrote(len(prepared))
+        return len(prepared)
+
+    def compile_insert_select(self, model):
+        """
+        Returns an sql.InsertSelect spamming rows of a given model inside
+        the database, or None if the database is not supported or the
+        model has a field the database can not spam like Spamdb would: a
+        field with choices, unique values, a handler other than the
+        built-in one or a type without SQL expression, or a foreign key
+        with a fan-out distribution or whose related keys are not
+        consecutive. Deferred fields are left out, as in compile_plan.
+        """
+        dialect = sql.dialect_for(model._meta.database)
+        if dialect is None or not model._meta.auto_increment or \
+                self.unique_indexes_for(model):
+            return None
+
+        deferred = self.deferred.get(model, ())
+        now = self.random_for(model).current_datetime()
+        pk = model._meta.primary_key
+        columns = []
+
+        for field_name, field in model._meta.get_sorted_fields():
+            if field_name in deferred or field is pk:
+                continue
+
+            field_class = field.__class__
+            params = (model, field_class, field_name)
+            handler = self.get_handler(*params)
+            column_handler = self.get_column_handler(*params)
+            if handler is None and column_handler is None:
+                continue  # not spammed
+            if field.choices or column_handler not in (
+                    None, SUPER_GLOBAL_COLUMN_HANDLERS.get(field_class)):
+                return None
+
+            if field_class is peewee.ForeignKeyField:
+                if handler != self.spam_foreignkeyfield or \
+                        field in self.fan_outs or \
+                        not field.rel_model._meta.auto_increment:
+                    return None
+                keys = self.key_pool(field.rel_model).current_keys()
+                if not keys or keys[-1] - keys[0] + 1 != len(keys):
+                    return None
+                expression = dialect.int_between(keys[0], keys[-1])
+            elif handler is SUPER_GLOBAL_HANDLERS.get(field_class):
+                expression = dialect.expression(field_class, now)
+            else:
+                expression = None
+            if expression is None:
+                return None
+
+            if field.null:
+                expression = dialect.nullable(expression)
+            columns.append((field.db_column, expression))
+
+        if not columns:
+            return None
+        return sql.InsertSelect(model, dialect, columns)
+
+    def insert_select(self, statement, n):
+        """
+        Runs a statement returned by compile_insert_select, inserting n
+        rows inside a single transaction.
+        Returns the number of inserted rows.
+        """
+        model = statement.model
+        with model._meta.database.transaction():
+            if self.profile:
+                self._timed_call('insert', model.__name__, statement.execute,
+                                 n)
+            else:
+                statement.execute(n)
+        self._spammed(model, n)
+
+        if model in self.key_pools:
+            self.key_pools[model].invalidate()
+
+        self._wrote(n)
+        return n
+
+    def _wrote(self, rows):
+        """
+        Lets the write policy of the run in progress commit, if due
+        """
+        if self.transactions is not None:
+            self.transactions.wrote(rows)
+
+    def dependency_levels(self):
+        """
+        Builds the dependency graph of the models out of their foreign keys
+        to other models of this Spamdb.
+        Returns a (levels, deferred) tuple: levels maps each model to its
+        depth in the graph, so models can be spammed after the ones they
+        point to. To break self references and cycles, nullable foreign keys
+        are left out of the graph; deferred maps each model to the names of
+        such fields, to be filled once every model was spammed.
+        """
+        models = []
+        for model in self.__iter__():
+            if model not in models:
+                models.append(model)
+
+        dependencies, deferred = {}, {}
+        for model in models:
+            dependencies[model] = {}
+            for field_name, field in model._meta.get_sorted_fields():
+                if not isinstance(field, peewee.ForeignKeyField) or \
+                        field.rel_model not in models:
+                    continue
+                if field.rel_model is model:
+                    tree = self.trees.get(model, None)
+                    if tree is not None and tree[0].name == field_name:
+                        continue  # parents are assigned by iter_tree
+                    if field.null and model._meta.auto_increment:
+                        deferred.setdefault(model, set()).add(field_name)
+                    continue
+                dependencies[model][field_name] = field.rel_model
+
+        levels = {}
+        while len(levels) < len(models):
+            pending = [model for model in models if model not in levels]
+            ready = [model for model in pending
+                     if all(related in levels
+                            for related in dependencies[model].values())]
+
+            for model in ready:
+                levels[model] = max([levels[related] + 1 for related in
+                                     dependencies[model].values()] or [0])
+            if ready:
+                continue
+
+            # every pending model is part of a cycle: drop one of its edges,
+            # a nullable one if possible
+            edges = [(model, field_name) for model in pending
+                     for field_name in sorted(dependencies[model])]
+            nullable = [(model, field_name) for model, field_name in edges
+                        if model._meta.fields[field_name].null and
+                        model._meta.auto_increment]
+            model, field_name = (nullable or edges)[0]
+            del dependencies[model][field_name]
+            if nullable:
+                deferred.setdefault(model, set()).add(field_name)
+
+        return levels, deferred
+
+    def export(self, path, format='csv', iterations=1,
+               batch_size=DEFAULT_BATCH_SIZE, counts=None):
+        """
+        Spams the models like run() does, but streams the rows to one file
+        per model in the `path` directory instead of saving them. Models are
+        spammed in dependency order. format is one of 'csv', 'jsonl' or
+        'copy' (PostgreSQL's COPY text format), files are named after the
+        model table and format.
+        Auto incremented primary keys are numbered from 1, and foreign keys
+        to exported models point to exported rows, so the files can be
+        loaded into empty tables. Foreign keys closing a cycle are left
+        NULL.
+        Returns a dict with the path of the file of each model.
+        """
+        writer_class = export.WRITERS[format]
+        levels, _ = self.dependency_levels()
+        models = sorted(set(self), key=lambda model: (levels[model],
+                                                      self.index(model)))
+        totals = dict((model, 0) for model in models)
+        for model, size in zip(self, self.sizes(iterations, counts)):
+            totals[model] += size
+        paths = {}
+
+        pools = self.key_pools
+        self.key_pools = dict(pools)  # other models keep using the database
+        # exported models only point to exported rows: the foreign keys
+        # closing a cycle, to models exported later, are left NULL
+        for model in models:
+            self.key_pools[model] = KeyPool(model, keys=[])
+        self._pin_now(self.now or datetime.datetime.now())
+        try:
+            for model in models:
+                pk = model._meta.primary_key
+                fields = model._meta.get_fields()
+                pool = self.key_pools[model]
+
+                paths[model] = os.path.join(path, '%s.%s' % (
+                    model._meta.db_table, writer_class.extension))
+                writer = writer_class(paths[model],
+                                      [field.db_column for field in fields])
+                try:
+                    if model in self.links:
+                        rows = self.iter_links(model, batch_size)
+                    elif model in self.trees:
+                        rows = self.iter_tree(model, totals[model],
+                                              batch_size)
+                    else:
+                        rows = self.iter_batches(model, batch_size,
+                                                 totals[model])
+                    next_key = 1
+                    for batch in rows:
+                        values = []
+                        for attrs in batch:
+                            data = model._meta.get_default_dict()
+                            data.update(attrs)
+                            if model._meta.auto_increment:
+                                data[pk.name] = next_key
+                                next_key += 1
+                            pool.add(data.get(pk.name))
+                            values.append(tuple(
+                                field.db_value(data.get(field.name))
+                                for field in fields))
+                        writer.write_rows(values)
+                finally:
+                    writer.close()
+        finally:
+            self.key_pools = pools
+            self._pin_now(None)
+
+        return paths
+
+    def _run_batches(self, model, size, batch_size):
+        """
+        Spams and inserts `size` rows of a model, batch_size rows per
+        transaction.
+        Returns the number of rows inserted.
+        """
+        count = 0
+        for start in range(0, size, batch_size):
+            rows = self.spam_rows(model, min(batch_size, size - start))
+            count += self.insert_rows(model, rows)
+        return count
+
+    def _run_insert_select(self, statement, size, batch_size):
+        """
+        Inserts `size` rows with a statement returned by
+        compile_insert_select, batch_size rows per transaction.
+        Returns the number of rows inserted.
+        """
+        count = 0
+        for start in range(0, size, batch_size):
+            count += self.insert_select(statement,
+                                        min(batch_size, size - start))
+        return count
+
+    def _run_tree(self, model, roots, batch_size):
+        """
+        Spams and inserts the trees of a model grown from `roots` rows,
+        batch_size rows per transaction.
+        Returns the number of rows inserted.
+        """
+        count = 0
+        for rows in self.iter_tree(model, roots, batch_size):
+            count += self.insert_rows(model, rows)
+        return count
+
+    def sizes(self, iterations, counts=None):
+        """
+        Returns the number of rows to spam for each position: the count of
+        its model, given here or to append, or `iterations`. When a model
+        with a count is appended more than once, its first position gets
+        the whole count. Linked models get 0, their rows are spammed by
+        iter_links after the other models.
+        """
+        targets = dict(self.counts)
+        targets.update(counts or {})
+        sizes = []
+        for position, model in enumerate(self.__iter__()):
+            if model in self.links:
+                sizes.append(0)  # see iter_links
+            elif model not in targets:
+                sizes.append(iterations)
+            elif self.index(model) == position:
+                sizes.append(targets[model])
+            else:
+                sizes.append(0)
+        return sizes
+
+    def run(self, iterations=1, batch_size=None, workers=None, counts=None,
+            checkpoint=None, resume=False, server_side=False, until=None):
+        """
+        Iterates through all models, spamming and saving each of them
+        `iterations` times, or the number of rows given for it in counts or
+        to append. Models are spammed one after the other, after the models
+        their foreign keys point to, see dependency_levels.
+        Foreign keys are spread among the related rows following the
+        distributions given to fan_out.
+        Models given to tree are spammed as trees, one level after the
+        other, the rows of the model being the roots.
+        If batch_size is given, rows are spammed batch_size at a time and
+        written with multi-row INSERTs, one transaction per batch, instead
+        of saving every object on its own.
+        If the Spamdb was given a write_policy, a WritePolicy, rows and
+        batches are committed following it instead. SQLite connections
+        are configured with the sqlite_pragmas given to the Spamdb, like
+        SEEDING_PRAGMAS, until the run is done.
+        If workers is given, rows are split in shards of batch_size rows
+        spammed by a pool of worker processes, each one with its
+        own connections. Shards of models at the same level of the
+        dependency graph are spammed concurrently. The random stream of each
+        shard is derived from the seed of the Spamdb instance, so shards
+        spam the same values no matter how many workers there are. Each
+        shard is committed on its own, whatever the write_policy.
+        Unique values already in the database are loaded before spamming,
+        see preload_unique. Workers only know about the unique values
+        spammed by themselves.
+        If checkpoint is the path of a file, rows are spammed in batches
+        and the progress of the run, along with the state of the random
+        streams, is saved to it after every batch. With resume=True, a run
+        that did not finish goes on from its last checkpoint: rows of the
+        model in progress inserted after it are deleted, if its primary
+        key is auto incremented, and spammed again. Linked models, see link,
+        can not be checkpointed.
+        If server_side is True, the rows of the models whose fields can all
+        be spammed by the database, see compile_insert_select, are inserted
+        with INSERT ... SELECT statements of batch_size rows, or a single
+        one, without sending their values from Python. The database picks
+        these values itself, so they do not follow the seed. The rest of
+        the models are spammed from Python.
+        If until is given, it maps models to the number of rows their
+        tables should hold, and only the missing rows are spammed, see
+        ensure. It can not be given along with counts.
+        Returns a dict with the number of rows spammed for each model.
+        """
+        if until is not None:
+            if counts is not None:
+                raise ValueError('until and counts can not be given '
+                                 'together, until holds the counts')
+            return self.ensure(until, iterations, batch_size=batch_size,
+                               workers=workers, checkpoint=checkpoint,
+                               resume=resume, server_side=server_side)
+
+        args = (iterations, batch_size, workers, counts, checkpoint, resume,
+                server_side)
+        databases = self._open_connections()
+        counters = []
+        if self.profile:
+            counters = [QueryCounter.add(database, self)
+                        for database in databases]
+        try:
+            # workers write in processes of their own, shard by shard
+            if self.write_policy is None or workers is not None:
+                return self._run(*args)
+            self.transactions = Transactions(databases, self.write_policy)
+            with self.transactions:
+                return self._run(*args)
+        finally:
+            self.transactions = None
+            for counter in counters:
+                counter.remove(self)
+            self._close_connections()
+
+    def _open_connections(self):
+        """
+        Opens the ConnectionPool of a run.
+        Returns the set of databases of the models.
+        """
+        databases = set(model._meta.database for model in self)
+        self.connections = ConnectionPool(databases, self.sqlite_pragmas)
+        self.connections.connect()
+        return databases
+
+    def _close_connections(self):
+        self.connections.restore()
+        self.connections = None
+
+    def ensure(self, counts=None, iterations=1, estimate=True, **kwargs):
+        """
+        Tops the tables of the models up to the number of rows given for
+        them in counts or to append, or `iterations` rows, spamming only
+        the rows they are missing, so running it again spams nothing.
+        The key pools of the models other models point to are loaded from
+        scratch, in one pass that also counts their rows. Other tables are
+        counted with the estimate of the database statistics if estimate is
+        True and the database keeps one (PostgreSQL), or with COUNT(*).
+        Trees count their roots, and linked models are only spammed while
+        their table is empty. Takes the other arguments of run().
+        Returns a dict with the number of rows spammed for each model.
+        """
+        targets = {}
+        for model, size in zip(self, self.sizes(iterations, counts)):
+            targets[model] = targets.get(model, 0) + size
+
+        related = set(field.rel_model for model in self
+                      for field in model._meta.get_fields()
+                      if isinstance(field, peewee.ForeignKeyField))
+        missing = {}
+        for model in targets:
+            if model in related:
+                # refreshed from scratch, so deleted rows are not counted
+                pool = self.key_pools[model] = KeyPool(model)
+                rows = len(pool.current_keys())
+            if model in self.trees:
+                field = self.trees[model][0]
+                rows = model.select().where(field >> None).count()
+            elif model not in related:
+                rows = sql.estimate_rows(model) if estimate else None
+                if rows is None:
+                    rows = model.select().count()
+            missing[model] = max(0, targets[model] - rows)
+
+        links = self.links
+        # linked models get rows only while their table is empty
+        self.links = dict((model, link) for model, link in links.items()
+                          if not model.select().exists())
+        try:
+            return self.run(counts=missing, **kwargs)
+        finally:
+            self.links = links
+
+    def arun(self, iterations=1, batch_size=DEFAULT_BATCH_SIZE, counts=None,
+             connections=1, queue_size=None, writer=None):
+        """
+        Coroutine spamming like run() with a batch_size, but writing the
+        batches while the next ones are spammed: rows are spammed in the
+        event loop and put in a queue, and up to `connections` batches are
+        written at once by the writer, an aio.ExecutorWriter writing from
+        a thread for each connection by default. The queue holds up to
+        queue_size batches, twice the number of connections by default, so
+        spamming waits for the writes to catch up.
+        Only available on Python 3.5 and later:
+            loop.run_until_complete(sdb.arun(100000, connections=4))
+        """
+        from . import aio
+        return aio.arun(self, iterations, batch_size, counts, connections,
+                        queue_size, writer)
+
+    def _run(self, iterations, batch_size, workers, counts, checkpoint,
+             resume, server_side):
+        if checkpoint is not None and workers is not None:
+            raise ValueError('Runs with workers can not be checkpointed')
+        if workers is not None and any(
+                isinstance(distribution, FixedPerParent)
+                for distribution in self.fan_outs.values()):
+            # each worker would count the rows handed to the parents itself
+            raise ValueError('Runs with workers can not follow a '
+                             'FixedPerParent fan-out')
+        if checkpoint is not None and self.links:
+            # their pairs would be spammed again when resuming
+            raise ValueError('Runs with linked models can not be '
+                             'checkpointed')
+        if server_side and workers is not None:
+            raise ValueError('Runs with workers can not be server side')
+
+        sizes, schedule, levels, deferred, last_keys = self._begin_run(
+            iterations, counts)
+        try:
+            if workers is not None:
+                positions = self._run_parallel(
+                    sizes, batch_size or DEFAULT_BATCH_SIZE, workers, levels)
+            elif checkpoint is not None:
+                positions = self._run_checkpointed(
+                    checkpoint, resume, sizes, schedule, last_keys,
+                    batch_size or DEFAULT_BATCH_SIZE, server_side)
+            else:
+                positions = [0] * len(self)
+                for position in schedule:
+                    model = self[position]
+                    statement = None
+                    if server_side and model not in self.trees:
+                        statement = self.compile_insert_select(model)
+                    if model in self.trees:
+                        positions[position] = self._run_tree(
+                            model, sizes[position],
+                            batch_size or DEFAULT_BATCH_SIZE)
+                    elif statement is not None:
+                        positions[position] = self._run_insert_select(
+                            statement, sizes[position],
+                            batch_size or sizes[position] or 1)
+                    elif batch_size is not None:
+                        positions[position] = self._run_batches(
+                            model, sizes[position], batch_size)
+                    else:
+                        for i in range(0, sizes[position]):
+                            self.spam_model(model, save=True)
+                        positions[position] = sizes[position]
+        finally:
+            self._end_run()
+
+        return self._finish_run(deferred, last_keys, positions,
+                                batch_size or DEFAULT_BATCH_SIZE)
+
+    def _run_checkpointed(self, path, resume, sizes, schedule, last_keys,
+                          batch_size, server_side=False):
+        """
+        Spams batches like run() does with a batch_size, saving a
+        checkpoint to path after each one. When resuming, sizes, batch_size,
+        last_keys, the random streams and the reference time are restored
+        from the checkpoint.
+        Returns the number of rows inserted for each position, counting the
+        ones inserted before resuming.
+        """
+        names = [model.__name__ for model in self]
+        state = checkpoints.load(path) if resume else None
+
+        if state is None:
+            state = {'models': names, 'sizes': sizes, 'done': [0] * len(self),
+                     'batch_size': batch_size, 'last_keys': {}, 'randoms': {},
+                     'saved_keys': {},
+                     'now': list(self.run_now.timetuple()[:6]) +
+                     [self.run_now.microsecond]}
+            for model, key in last_keys.items():
+                state['last_keys'][str(self.index(model))] = key
+        else:
+            if state['models'] != names:
+                raise ValueError('The checkpoint at %s was saved for the '
+                                 'models %s' % (path, state['models']))
+            sizes = state['sizes']
+            batch_size = state['batch_size']
+            for position, key in state['last_keys'].items():
+                last_keys[self[int(position)]] = key
+            for position, random_state in state['randoms'].items():
+                rng = self.random_for(self[int(position)])
+                checkpoints.set_random_state(rng, random_state)
+            self._pin_now(datetime.datetime(*state['now']))
+            self._drop_unsaved_rows(state)
+
+        def save(commit=False):
+            # checkpoints can only count committed rows
+            if self.transactions is not None:
+                if commit:
+                    self.transactions.commit()
+                elif self.transactions.pending:
+                    return
+            checkpoints.save(path, state)
+
+        done = state['done']
+        saved_keys = state['saved_keys']
+        for position in schedule:
+            model = self[position]
+            rng = self.random_for(model)
+            auto_increment = model._meta.auto_increment
+            if done[position] < sizes[position] and auto_increment and \
+                    str(position) not in saved_keys:
+                # rows inserted after this key are dropped when resuming
+                saved_keys[str(position)] = self._last_key(model)
+                save(commit=True)
+            statement = None
+            if server_side and model not in self.trees and \
+                    done[position] < sizes[position]:
+                statement = self.compile_insert_select(model)
+            while done[position] < sizes[position]:
+                size = min(batch_size, sizes[position] - done[position])
+                if model in self.trees:
+                    # trees are checkpointed once all their levels are done
+                    done[position] = self._run_tree(model, sizes[position],
+                                                    batch_size)
+                elif statement is not None:
+                    done[position] += self.insert_select(statement, size)
+                else:
+                    done[position] += self.insert_rows(
+                        model, self.spam_rows(model, size))
+                state['randoms'][str(position)] = \
+                    checkpoints.random_state(rng)
+                if auto_increment:
+                    saved_keys[str(position)] = self._last_key(model)
+                save()
+
+        save(commit=True)
+        return done
+
+    def _drop_unsaved_rows(self, state):
+        """
+        Deletes the rows of the models in progress inserted after their
+        last checkpoint, and loads their unique values again without them
+        """
+        for position, key in state['saved_keys'].items():
+            position = int(position)
+            if state['done'][position] < state['sizes'][position]:
+                model = self[position]
+                query = model.delete()
+                if key is not None:
+                    query = query.where(model._meta.primary_key > key)
+                query.execute()
+                # the values of the deleted rows are spammed again
+                self.unique_indexes.pop(model, None)
+                self.preload_unique(model)
+
+    def _begin_run(self, iterations, counts):
+        """
+        Gets ready to spam the models: refreshes the key pools and the
+        unique values, defers the foreign keys closing cycles and pins the
+        reference time.
+        Returns a (sizes, schedule, levels, deferred, last_keys) tuple:
+        the rows to spam for each position, the positions in dependency
+        order, the levels and deferred fields as returned by
+        dependency_levels and the last primary key of the models with
+        deferred fields.
+        """
+        sizes = self.sizes(iterations, counts)
+
+        for pool in self.key_pools.values():
+            pool.reset()  # rows may have been inserted or deleted since
+
+        for model in self:
+            self.preload_unique(model)
+
+        levels, deferred = self.dependency_levels()
+        schedule = sorted(range(len(self)),
+                          key=lambda position: (levels[self[position]],
+                                                position))
+        last_keys = dict((model, self._last_key(model)) for model in deferred)
+
+        self.deferred = deferred
+        self.plans.clear()
+        self._pin_now(self.now or datetime.datetime.now())
+
+        return sizes, schedule, levels, deferred, last_keys
+
+    def _end_run(self):
+        """
+        Undoes the changes made by _begin_run, whether the run failed or not
+        """
+        self.deferred = {}
+        self.plans.clear()
+        self._pin_now(None)
+
+    def _finish_run(self, deferred, last_keys, positions, batch_size):
+        """
+        Fills the deferred foreign keys and spams the linked models once
+        every other model was spammed.
+        Returns a dict with the number of rows spammed for each model, out
+        of the number of rows spammed for each position.
+        """
+        for model, field_names in deferred.items():
+            self._fill_deferred(model, field_names, last_keys[model],
+                                batch_size)
+
+        for position, model in enumerate(self.__iter__()):
+            if model in self.links and self.index(model) == position:
+                for rows in self.iter_links(model, batch_size):
+                    positions[position] += self.insert_rows(model, rows)
+
+        counts = dict((model, 0) for model in self)
+        for model, count in zip(self, positions):
+            counts[model] += count
+
+        return counts
+
+    def _last_key(self, model):
+        """
+        Returns the greatest primary key of a model
+        """
+        pk = model._meta.primary_key
+        return model.select(peewee.fn.Max(pk)).scalar()
+
+    def _fill_deferred(self, model, field_names, last_key, batch_size):
+        """
+        Spams the deferred foreign keys of the rows inserted after last_key,
+        updating batch_size rows per transaction
+        """
+        pk = model._meta.primary_key
+        plan = [step for step in self.compile_plan(model)
+                if step[0] in field_names]
+        rng = self.random_for(model)
+
+        while True:
+            query = model.select(pk).order_by(pk).limit(batch_size).tuples()
+            if last_key is not None:
+                query = query.where(pk > last_key)
+            keys = [row[0] for row in query]
+            if not keys:
+                break
+
+            with model._meta.database.transaction():
+                for key in keys:
+                    attrs = {}
+                    for field_name, nullable, handler, params, _ in plan:
+                        if nullable and _coin_toss(rng):
+                            continue
+                        value = handler(*params)
+                        related_model = model._meta.fields[field_name].rel_model
+                        if value == key and related_model is model:
+                            continue  # a row can not be its own parent
+                        attrs[field_name] = value
+                    if attrs:
+                        model.update(**attrs).where(pk == key).execute()
+
+            self._wrote(len(keys))
+            last_key = keys[-1]
+
+    def _run_parallel(self, sizes, batch_size, workers, levels):
+        """
+        Spams shards of batch_size rows with a pool of processes, one level
+        of the dependency graph after the other. sizes holds the number of
+        rows to spam for each position.
+        Returns the number of rows inserted for each model, in order.
+        """
+        global _worker_spamdb
+
+        # workers are forked so they inherit the handlers, which may not
+        # be picklable
+        import multiprocessing
+
+        if hasattr(multiprocessing, 'get_context'):
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing
+
+        positions = [0] * len(self)
+
+        _worker_spamdb = self
+        pool = context.Pool(workers, initializer=_init_worker)
+        try:
+            for level in sorted(set(levels.values())):
+                # trees need the keys of each level, they are spammed here
+                for position, (model, size) in enumerate(
+                        zip(self.__iter__(), sizes)):
+                    if levels[model] == level and model in self.trees:
+                        positions[position] += self._run_tree(
+                            model, size, batch_size)
+                tasks = [(position, index, min(batch_size, size - start))
+                         for position, (model, size) in
+                         enumerate(zip(self.__iter__(), sizes))
+                         if levels[model] == level and
+                         model not in self.trees
+                         for index, start in
+                         enumerate(range(0, size, batch_size))]
+                for position, count, shard_stats in pool.imap(
+                        _run_shard, tasks, chunksize=1):
+                    positions[position] += count
+                    self._merge_stats(shard_stats)
+                    if self.progress is not None:
+                        self.progress(self[position], count)
+        finally:
+            pool.close()
+            pool.join()
+            _worker_spamdb = None
+
+        return positions
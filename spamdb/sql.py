@@ -0,0 +1,167 @@
+"""
+INSERT ... SELECT statements spamming rows inside the database, used by
+Spamdb.run(server_side=True). Values are computed by SQL expressions
+following the ranges of the built-in handlers, so no row data is sent from
+Python. See Spamdb.compile_insert_select.
+Also reads the row estimates of the database statistics, see Spamdb.ensure.
+"""
+
+import peewee
+
+
+class Dialect(object):
+    """
+    Format strings of the SQL expressions of a database. Every value is
+    inlined, they are all numbers and dates formatted here.
+    """
+    series = None  # FROM clause yielding {n} rows
+    with_series = ''  # common table expression the series needs, if any
+    random_int = None  # integer between {low} and {low} + {size} - 1
+    coin_toss = None  # condition true half of the times
+    boolean = None
+    real = None  # type floats are cast to
+    minus_minutes = None  # the datetime {now} minus {minutes}
+    minus_days = None  # the date {today} minus {days}
+    time_of_day = None  # the time {seconds} after midnight
+    row_estimate = None  # query estimating the rows of the table {param}
+
+    def int_between(self, low, high):
+        return self.random_int.format(low=int(low), size=int(high - low + 1))
+
+    def nullable(self, expression):
+        """
+        Returns an expression being NULL half of the times, like the
+        nullable fields spammed from Python
+        """
+        return 'CASE WHEN %s THEN NULL ELSE %s END' % (self.coin_toss,
+                                                        expression)
+
+    def expression(self, field_class, now):
+        """
+        Returns the expression spamming values of a field class like its
+        built-in handler does, or None if there is none. now is the
+        reference datetime of the date fields.
+        """
+        if field_class is peewee.IntegerField:
+            return self.int_between(-10000, 10000)
+        if field_class is peewee.BigIntegerField:
+            return self.int_between(-10000000000, 10000000000)
+        if field_class is peewee.BooleanField:
+            return self.boolean
+        if field_class in (peewee.FloatField, peewee.DoubleField):
+            return 'CAST(%s AS %s) / %s' % (self.int_between(-10000, 10000),
+                                            self.real,
+                                            self.int_between(1, 10000))
+        if field_class is peewee.DateTimeField:
+            return self.minus_minutes.format(
+                now="'%s'" % now.isoformat(' '),
+                minutes=self.int_between(0, 86400))
+        if field_class is peewee.DateField:
+            return self.minus_days.format(
+                today="'%s'" % now.date().isoformat(),
+                days=self.int_between(0, 59))
+        if field_class is peewee.TimeField:
+            return self.time_of_day.format(seconds=self.int_between(0, 86399))
+        return None
+
+
+class SqliteDialect(Dialect):
+    """
+    Rows come out of a recursive common table expression. Dates are stored
+    as text, without the microseconds.
+    """
+    with_series = ('WITH RECURSIVE spamdb_series(x) AS (SELECT 1 UNION ALL '
+                   'SELECT x + 1 FROM spamdb_series WHERE x < {n}) ')
+    series = 'spamdb_series'
+    # random() is a signed 64 bit integer
+    random_int = '((random() % {size} + {size}) % {size} + {low})'
+    coin_toss = 'random() < 0'
+    boolean = '((random() % 2 + 2) % 2)'
+    real = 'REAL'
+    minus_minutes = "datetime({now}, '-' || {minutes} || ' minutes')"
+    minus_days = "date({today}, '-' || {days} || ' days')"
+    time_of_day = "time({seconds}, 'unixepoch')"
+
+
+class PostgresqlDialect(Dialect):
+    """
+    Rows come out of generate_series
+    """
+    series = 'generate_series(1, {n})'
+    random_int = '(floor(random() * {size})::bigint + {low})'
+    coin_toss = 'random() < 0.5'
+    boolean = 'random() < 0.5'
+    real = 'double precision'
+    minus_minutes = "(CAST({now} AS timestamp) - {minutes} * interval " \
+                    "'1 minute')"
+    minus_days = '(CAST({today} AS date) - CAST({days} AS integer))'
+    time_of_day = "(time '00:00' + {seconds} * interval '1 second')"
+    row_estimate = 'SELECT reltuples FROM pg_class ' \
+                   'WHERE oid = CAST({param} AS regclass)'
+
+
+DIALECTS = (
+    (peewee.SqliteDatabase, SqliteDialect),
+    (peewee.PostgresqlDatabase, PostgresqlDialect),
+)
+
+
+def dialect_for(database):
+    """
+    Returns the Dialect of a database, or None if it is not supported
+    """
+    for database_class, dialect_class in DIALECTS:
+        if isinstance(database, database_class):
+            return dialect_class()
+    return None
+
+
+def estimate_rows(model):
+    """
+    Returns the number of rows of the table of a model estimated by the
+    statistics of its database, or None if there are none
+    """
+    database = model._meta.database
+    dialect = dialect_for(database)
+    if dialect is None or dialect.row_estimate is None:
+        return None
+    qc = database.compiler()
+    row = database.execute_sql(
+        dialect.row_estimate.format(param=database.interpolation),
+        (qc.quote(model._meta.db_table),)).fetchone()
+    # tables never analyzed have no estimate, or a negative one
+    if row is None or row[0] is None or row[0] <= 0:
+        return None
+    return int(row[0])
+
+
+class InsertSelect(object):
+    """
+    A statement inserting n rows of a model, given the expressions of its
+    columns
+    """
+
+    def __init__(self, model, dialect, columns):
+        """
+        columns is a list of (db_column, expression) tuples
+        """
+        self.model = model
+        self.dialect = dialect
+        self.columns = columns
+
+    def sql(self, n):
+        qc = self.model._meta.database.compiler()
+        return '%sINSERT INTO %s (%s) SELECT %s FROM %s' % (
+            self.dialect.with_series.format(n=int(n)),
+            qc.quote(self.model._meta.db_table),
+            ', '.join([qc.quote(column) for column, _ in self.columns]),
+            ', '.join([expression for _, expression in self.columns]),
+            self.dialect.series.format(n=int(n)))
+
+    def execute(self, n):
+        """
+        Inserts n rows, returns n
+        """
+        if n > 0:
+            self.model._meta.database.execute_sql(self.sql(n))
+        return n
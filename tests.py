@@ -1,16 +1,38 @@
 import unittest
+import csv
 import datetime
 import decimal
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import types
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from spamdb import SUPER_GLOBAL_HANDLERS, super_global_handler, _decorate,\
+    SUPER_GLOBAL_COLUMN_HANDLERS, spam_integercolumn, spam_bigintegercolumn,\
+    spam_booleancolumn, spam_floatcolumn, spam_decimalcolumn,\
+    spam_datetimecolumn, spam_datecolumn, spam_timecolumn,\
     Spamdb, spam_charfield, spam_textfield, spam_datetimefield,\
     spam_floatfield, spam_doublefield, spam_bigintegerfield,\
     spam_decimalfield, spam_primarykeyfield, spam_timefield,\
     spam_integerfield, spam_booleanfield, spam_datefield,\
-    spam_foreignkeyfield, spam_choices
+    spam_foreignkeyfield, spam_choices, KeyPool, Zipf, FixedPerParent,\
+    text_handler, TextPool, WritePolicy, ConnectionPool, SEEDING_PRAGMAS,\
+    seedable
+from spamdb.connections import QueryCounter
+from spamdb import lorem_ipsum, bench
+from spamdb import __main__ as cli
 from peewee import CharField, ForeignKeyField, TextField, DateTimeField,\
     PrimaryKeyField, DecimalField, FloatField, BigIntegerField,\
     IntegerField, BooleanField, DateField, TimeField, Model, DoubleField,\
-    SqliteDatabase
+    SqliteDatabase, OperationalError
 
 
 class TestModel(Model):
@@ -71,6 +93,31 @@ class UniqueModel(TestModel):
     name = CharField(unique=True)
 
 
+class OverlappingIndexModel(TestModel):
+    a = CharField()
+    b = CharField()
+    c = CharField()
+
+    class Meta:
+        indexes = (
+            (('a', 'b'), True),
+            (('b', 'c'), True),
+        )
+
+
+class UniqueIndexCharModel(TestModel):
+    email = CharField(max_length=30)
+
+    class Meta:
+        indexes = (
+            (('email',), True),
+        )
+
+
+class CharKeyModel(TestModel):
+    code = CharField(max_length=16, primary_key=True)
+
+
 class ChoicesModel(TestModel):
     status = IntegerField(choices=(1, 2, 3))
 
@@ -135,6 +182,17 @@ class MultiIndexModel(TestModel):
         )
 
 
+class Reading(TestModel):
+    user = ForeignKeyField(User, related_name='readings')
+    value = IntegerField()
+    total = BigIntegerField(null=True)
+    ratio = FloatField()
+    taken = DateTimeField()
+    day = DateField()
+    at = TimeField()
+    ok = BooleanField()
+
+
 class BlogTwo(Blog):
     title = TextField()
     extra_field = CharField()
@@ -160,10 +218,23 @@ class OrphanPet(TestModel):
     orphan = ForeignKeyField(Orphan)
 
 
+class Shop(TestModel):
+    name = CharField()
+
+
+class Owner(TestModel):
+    shop = ForeignKeyField(Shop, related_name='owners')
+
+
+# closes a cycle, Shop is declared before Owner
+ForeignKeyField(Owner, null=True, related_name='owned_shops').add_to_class(
+    Shop, 'owner')
+
+
 MODELS = [User, Blog, Comment, Relationship, NullModel, UniqueModel,
           OrderedModel, Category, UserCategory, NonIntModel, NonIntRelModel,
           DBUser, DBBlog, SeqModelA, SeqModelB, MultiIndexModel,
-          BlogTwo, ChoicesModel]
+          BlogTwo, ChoicesModel, Reading, OverlappingIndexModel, Shop, Owner]
 
 
 def drop_tables(only=None):
@@ -225,6 +296,13 @@ class AddModelTestCase(unittest.TestCase):
         self.assertEquals(sdb[1], Blog)
         self.assertEquals(sdb[2], Comment)
 
+    def test_unknown_option(self):
+        """
+        Expect a TypeError for misspelled options, instead of ignoring them
+        """
+        self.assertRaises(TypeError, Spamdb, User, sed=1)
+        self.assertRaises(TypeError, Spamdb, profle=True)
+
 
 class HandlerDecoratorsTestCase(unittest.TestCase):
     """
@@ -342,6 +420,67 @@ class HandlerDecoratorsTestCase(unittest.TestCase):
         self.assertEquals(handler3, spam_charfield)
 
 
+class LoremIpsumTestCase(unittest.TestCase):
+    """
+    Test the lorem ipsum text functions
+    """
+
+    def test_sentence(self):
+        """
+        Expect a capitalized sentence ending in a period or question mark
+        """
+        for s in lorem_ipsum.sentences(20):
+            self.assertTrue(s[0].isupper())
+            self.assertTrue(s[-1] in '?.')
+            for section in s[:-1].lower().split(', '):
+                words = section.split(' ')
+                self.assertTrue(3 <= len(words) <= 12)
+                self.assertEquals(len(set(words)), len(words))
+
+    def test_sentence_max_length(self):
+        """
+        Expect sentences of at most max_length characters
+        """
+        for max_length in (1, 8, 40, 300):
+            for i in range(20):
+                s = lorem_ipsum.sentence(max_length)
+                self.assertTrue(0 < len(s) <= max_length)
+                self.assertEquals(s, s.strip())
+
+    def test_short_sentence(self):
+        """
+        Expect short sentences to be picked from a cache of candidates
+        """
+        s = lorem_ipsum.short_sentence(8)
+        self.assertTrue(len(s) <= 8)
+        self.assertTrue(s in lorem_ipsum._short_sentences[8])
+        self.assertEquals(len(lorem_ipsum._short_sentences[8]),
+                          lorem_ipsum.SHORT_CACHE_SIZE)
+        lorem_ipsum.short_sentence(lorem_ipsum.SHORT_LENGTH + 1)
+        self.assertFalse(lorem_ipsum.SHORT_LENGTH + 1 in
+                         lorem_ipsum._short_sentences)
+
+    def test_paragraphs(self):
+        """
+        Expect the first paragraph to be the common one
+        """
+        paras = lorem_ipsum.paragraphs(3)
+        self.assertEquals(len(paras), 3)
+        self.assertEquals(paras[0], lorem_ipsum.COMMON_P)
+        self.assertNotEquals(lorem_ipsum.paragraphs(1, common=False)[0],
+                             lorem_ipsum.COMMON_P)
+        self.assertEquals(lorem_ipsum.paragraphs(0), [])
+
+    def test_words(self):
+        """
+        Expect the requested number of words
+        """
+        self.assertEquals(lorem_ipsum.words(5), 'lorem ipsum dolor sit amet')
+        self.assertEquals(len(lorem_ipsum.words(500).split(' ')), 500)
+        words = lorem_ipsum.words(len(lorem_ipsum.WORDS), common=False)
+        self.assertEquals(set(words.split(' ')), set(lorem_ipsum.WORDS))
+
+
 class SpamFunctionsTestCase(ModelTestCase):
     """
     Test that all spam functions return expected values
@@ -459,6 +598,260 @@ class SpamFunctionsTestCase(ModelTestCase):
         self.assertEquals(u.id, spam_model.id)
 
 
+class TextHandlerTestCase(unittest.TestCase):
+    """
+    Test TextField handlers built by text_handler
+    """
+    params = (Blog, TextField, 'content')
+
+    def test_length(self):
+        """
+        Expect texts of the length given
+        """
+        spam_text = text_handler(length=500)
+        self.assertEquals(len(spam_text(*self.params)), 500)
+        spam_text = text_handler(length=(100, 200), pool=TextPool(10))
+        for i in range(20):
+            self.assertTrue(100 <= len(spam_text(*self.params)) <= 200)
+        spam_text = text_handler(length=lambda rng: 42)
+        self.assertEquals(len(spam_text(*self.params)), 42)
+
+    def test_paragraphs(self):
+        """
+        Expect texts of the number of paragraphs given
+        """
+        spam_text = text_handler(paragraphs=3)
+        self.assertEquals(spam_text(*self.params).count('\n\n'), 2)
+        spam_text = text_handler(paragraphs=(2, 4), pool=TextPool(10))
+        for i in range(20):
+            self.assertTrue(1 <= spam_text(*self.params).count('\n\n') <= 3)
+
+    def test_pool(self):
+        """
+        Expect single paragraphs to be taken from the pool as they are
+        """
+        pool = TextPool(5)
+        self.assertEquals(len(pool.paragraphs), 5)
+        self.assertEquals(TextPool(5).paragraphs, pool.paragraphs)
+        spam_text = text_handler(paragraphs=1, pool=pool)
+        text = spam_text(*self.params)
+        self.assertTrue(any(text is p for p in pool.paragraphs))
+
+    def test_seedable(self):
+        """
+        Expect the same texts for the same random stream
+        """
+        spam_text = text_handler(length=(10, 1000))
+        self.assertTrue(spam_text.seedable)
+        texts = [spam_text(*self.params, rng=random.Random(1))
+                 for i in range(2)]
+        self.assertEquals(texts[0], texts[1])
+
+
+class KeyPoolTestCase(ModelTestCase):
+    """
+    Test that a KeyPool holds the primary keys of a model
+    """
+    requires = [User, Blog, NonIntModel]
+
+    def test_sample(self):
+        """
+        Expect one of the primary keys of the model, or None if there
+        are no rows
+        """
+        pool = KeyPool(User)
+        self.assertEquals(pool.sample(), None)
+        self.create_users(3)
+        pool.invalidate()
+        self.assertTrue(pool.sample() in (1, 2, 3))
+
+    def test_incremental_refresh(self):
+        """
+        Expect only the rows inserted since the last refresh to be loaded
+        """
+        self.create_users(2)
+        pool = KeyPool(User)
+        pool.refresh()
+        self.create_user('u3')
+        pool.invalidate()
+        pool.refresh()
+        pool.add(self.create_user('u4').id)
+        pool.invalidate()
+        pool.refresh()
+        self.assertEquals(pool.keys, [1, 2, 3, 4])
+
+    def test_non_int_keys(self):
+        """
+        Expect non auto incremented keys to be reloaded
+        """
+        NonIntModel.create(pk='a', data='a')
+        pool = KeyPool(NonIntModel)
+        pool.refresh()
+        NonIntModel.create(pk='b', data='b')
+        pool.invalidate()
+        pool.refresh()
+        self.assertEquals(sorted(pool.keys), ['a', 'b'])
+
+    def test_deleted_rows(self):
+        """
+        Expect a reused Spamdb not to pick the keys of rows deleted since
+        its last run
+        """
+        sdb = Spamdb(User, Blog)
+        sdb.run(iterations=5)
+        Blog.delete().execute()
+        User.delete().execute()
+        sdb.run(counts={User: 2, Blog: 50})
+        user_ids = set(u.id for u in User.select())
+        blog_users = set(row[0] for row in Blog.select(Blog.user).tuples())
+        self.assertTrue(blog_users <= user_ids)
+
+    def test_spam_foreignkeyfield(self):
+        """
+        Expect a Spamdb instance to spam foreign keys with primary key
+        values taken from its pools
+        """
+        u = self.create_user('user')
+        sdb = Spamdb(Blog)
+        self.assertEquals(sdb.spam_fields(Blog)['user'], u.id)
+        self.assertTrue(User in sdb.key_pools)
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class SpamColumnFunctionsTestCase(unittest.TestCase):
+    """
+    Test that all column spam functions return n expected values
+    """
+
+    def spam_column(self, handler, field_name):
+        field = getattr(FieldsTestModel, field_name)
+        values = handler(FieldsTestModel, field.__class__, field_name, 50)
+        self.assertEquals(len(values), 50)
+        return values
+
+    def test_spam_integercolumn(self):
+        for value in self.spam_column(spam_integercolumn, 'integer'):
+            self.assertTrue(-10000 <= value <= 10000)
+
+    def test_spam_bigintegercolumn(self):
+        ten_million = 10 ** 10
+        for value in self.spam_column(spam_bigintegercolumn, 'bigint'):
+            self.assertTrue(-ten_million <= value <= ten_million)
+
+    def test_spam_booleancolumn(self):
+        for value in self.spam_column(spam_booleancolumn, 'boolean'):
+            self.assertEquals(type(value), bool)
+
+    def test_spam_floatcolumn(self):
+        for value in self.spam_column(spam_floatcolumn, 'floatnum'):
+            self.assertEquals(type(value), float)
+
+    def test_spam_decimalcolumn(self):
+        for value in self.spam_column(spam_decimalcolumn, 'decimal_num'):
+            self.assertEquals(type(value), decimal.Decimal)
+
+    def test_spam_datetimecolumn(self):
+        now = datetime.datetime.now()
+        tomorrow = now + datetime.timedelta(days=1)
+        two_moths_ago = now - datetime.timedelta(minutes=86400)
+        for value in self.spam_column(spam_datetimecolumn, 'datetime'):
+            self.assertEquals(type(value), datetime.datetime)
+            self.assertTrue(two_moths_ago <= value < tomorrow)
+
+    def test_spam_datecolumn(self):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        two_moths_ago = datetime.date.today() - datetime.timedelta(days=60)
+        for value in self.spam_column(spam_datecolumn, 'date'):
+            self.assertEquals(type(value), datetime.date)
+            self.assertTrue(two_moths_ago <= value < tomorrow)
+
+    def test_spam_timecolumn(self):
+        for value in self.spam_column(spam_timecolumn, 'time'):
+            self.assertEquals(type(value), datetime.time)
+
+
+class SpamRowsTestCase(unittest.TestCase):
+    """
+    Test that Spamdb.spam_rows spams n rows one column at a time
+    """
+
+    def test_spam_rows(self):
+        """
+        Expect column handlers to be called once per column, for the rows
+        not left NULL
+        """
+        sdb = Spamdb(NullModel, seed=42)
+        calls = []
+
+        @sdb.global_column_handler(IntegerField)
+        def spam_integercolumn(model, field_type, field_name, n):
+            calls.append(n)
+            return [1] * n
+
+        rows = sdb.spam_rows(NullModel, 10)
+        self.assertEquals(len(rows), 10)
+        spammed = [attrs['int_field'] for attrs in rows
+                   if 'int_field' in attrs]
+        self.assertEquals(calls, [len(spammed)])
+        self.assertEquals(spammed, [1] * len(spammed))
+
+    def test_scalar_fallback(self):
+        """
+        Expect fields without a column handler to be spammed by their
+        regular handler
+        """
+        sdb = Spamdb(ChoicesModel)
+        sdb.global_column_handlers.clear()
+        rows = sdb.spam_rows(ChoicesModel, 5)
+        for attrs in rows:
+            self.assertTrue(attrs['status'] in ChoicesModel.status.choices)
+
+    def test_handler_precedence(self):
+        """
+        Expect handlers registered by hand to shadow built-in column handlers
+        """
+        sdb = Spamdb(SeqModelA)
+
+        @sdb.global_handler(IntegerField)
+        def spam_integerfield(model, field_type, field_name):
+            return 7
+
+        self.assertTrue(IntegerField not in sdb.global_column_handlers)
+        rows = sdb.spam_rows(SeqModelA, 3)
+        self.assertEquals([attrs['num'] for attrs in rows], [7, 7, 7])
+
+
+class IterRowsTestCase(unittest.TestCase):
+    """
+    Test that Spamdb.iter_rows and iter_batches generate rows lazily,
+    without saving them
+    """
+
+    def test_iter_batches(self):
+        """
+        Expect batches of at most batch_size rows, up to n rows
+        """
+        batches = list(Spamdb().iter_batches(ChoicesModel, batch_size=4, n=10))
+        self.assertEquals([len(rows) for rows in batches], [4, 4, 2])
+        for rows in batches:
+            for attrs in rows:
+                self.assertTrue(attrs['status'] in ChoicesModel.status.choices)
+
+    def test_iter_rows(self):
+        """
+        Expect dicts, or tuples following the fields order
+        """
+        rows = list(Spamdb().iter_rows(ChoicesModel, n=5))
+        self.assertEquals(len(rows), 5)
+        self.assertEquals(set(rows[0]), set(['id', 'status']))
+
+        rows = Spamdb().iter_rows(ChoicesModel, tuples=True, batch_size=2)
+        for i in range(7):  # endless
+            pk, status = next(rows)
+            self.assertEquals(pk, None)
+            self.assertTrue(status in ChoicesModel.status.choices)
+
+
 class SpamFieldsTestCase(unittest.TestCase):
     """
     Test that the Spamdb.spam_fields function returns a dict with the
@@ -493,6 +886,1072 @@ class SpamFieldsTestCase(unittest.TestCase):
         self.assertEquals(spammed_attr['test_integerfield'], 1)
 
 
+class RunWorkersTestCase(ModelTestCase):
+    """
+    Test that run() with workers spams the models from many processes
+    """
+    requires = [User, Blog]
+
+    def test_workers_iterations(self):
+        """
+        Expect the rows spammed by every worker to be counted
+        """
+        sdb = Spamdb(User, Blog)
+        counts = sdb.run(iterations=25, batch_size=4, workers=3)
+        self.assertEquals(counts, {User: 25, Blog: 25})
+        self.assertEquals(User.select().count(), 25)
+        self.assertEquals(Blog.select().count(), 25)
+        user_ids = set(u.id for u in User.select())
+        for blog in Blog.select():
+            self.assertTrue(blog.user.id in user_ids)
+
+    def test_workers_seed(self):
+        """
+        Expect the same values for the same seed, whatever the number of
+        workers
+        """
+        names = []
+        for workers in (2, 3):
+            drop_tables(self.requires)
+            create_tables(self.requires)
+            Spamdb(User, seed=42).run(iterations=12, batch_size=3,
+                                      workers=workers)
+            names.append(sorted(u.username for u in User.select()))
+        self.assertEquals(names[0], names[1])
+
+
+class DependenciesTestCase(ModelTestCase):
+    """
+    Test that run() spams models after the models they point to
+    """
+    requires = [User, Blog, Comment, Category]
+
+    def test_dependency_levels(self):
+        """
+        Expect each model to be one level deeper than the models it
+        points to, and self references to be deferred
+        """
+        sdb = Spamdb(Comment, Category, Blog, User)
+        levels, deferred = sdb.dependency_levels()
+        self.assertEquals(levels, {User: 0, Blog: 1, Comment: 2,
+                                   Category: 0})
+        self.assertEquals(deferred, {Category: set(['parent'])})
+
+    def test_children_first(self):
+        """
+        Expect every row to point to a related row, even if models were
+        added before the models they point to
+        """
+        for kwargs in ({}, {'batch_size': 2}, {'workers': 2}):
+            counts = Spamdb(Comment, Blog, User).run(iterations=5, **kwargs)
+            self.assertEquals(counts, {User: 5, Blog: 5, Comment: 5})
+            self.assertEquals(Comment.select().where(
+                Comment.blog >> None).count(), 0)
+            self.assertEquals(Blog.select().where(
+                Blog.user >> None).count(), 0)
+
+    def test_self_reference(self):
+        """
+        Expect self references to be filled after every row was inserted,
+        without rows pointing to themselves
+        """
+        Spamdb(Category).run(iterations=30, batch_size=7)
+        sdb = Spamdb(Category)
+        sdb.run(iterations=30)
+        self.assertEquals(Category.select().count(), 60)
+        self.assertTrue(Category.select().where(
+            ~(Category.parent >> None)).count() > 0)
+        ids = set(c.id for c in Category.select())
+        for category_id, parent_id in Category.select(
+                Category.id, Category.parent).tuples():
+            self.assertNotEquals(parent_id, category_id)
+            self.assertTrue(parent_id in ids | set([None]))
+        self.assertEquals(sdb.deferred, {})
+
+
+class TreeTestCase(ModelTestCase):
+    """
+    Test that self-referential models are spammed as trees
+    """
+    requires = [User, Category, UserCategory]
+
+    def setUp(self):
+        super(TreeTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TreeTestCase, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def depths(self):
+        parents = dict(Category.select(Category.id, Category.parent).tuples())
+        depths = {}
+        for key in parents:
+            depth, parent = 0, parents[key]
+            while parent is not None:
+                depth, parent = depth + 1, parents[parent]
+            depths[key] = depth
+        return depths
+
+    def test_tree(self):
+        """
+        Expect every row but the roots to point to a row one level up,
+        whatever the run mode
+        """
+        for kwargs in ({}, {'batch_size': 4}, {'workers': 2},
+                       {'checkpoint': os.path.join(self.directory,
+                                                   'checkpoint')}):
+            Category.delete().execute()
+            sdb = Spamdb(Category, seed=3)
+            sdb.tree(Category, depth=3, branching=2)
+            counts = sdb.run(iterations=2, **kwargs)
+            self.assertEquals(counts, {Category: 14})
+            depths = self.depths()
+            self.assertEquals(sorted(depths.values()),
+                              [0] * 2 + [1] * 4 + [2] * 8)
+            for category in Category.select():
+                self.assertEquals(category.children.count(),
+                                  2 if depths[category.id] < 2 else 0)
+
+    def test_branching(self):
+        """
+        Expect the branching of each row to be drawn from a range, and the
+        rows pointing to the tree to be spammed after it
+        """
+        sdb = Spamdb(UserCategory, User, Category, seed=1)
+        sdb.tree(Category, depth=4, branching=(0, 3))
+        counts = sdb.run(iterations=3, batch_size=5)
+        depths = self.depths()
+        self.assertEquals(counts[Category], len(depths))
+        self.assertEquals(len([d for d in depths.values() if d == 0]), 3)
+        self.assertTrue(max(depths.values()) <= 3)
+        for category in Category.select():
+            self.assertTrue(category.children.count() <= 3)
+        self.assertEquals(UserCategory.select().where(
+            UserCategory.category >> None).count(), 0)
+
+    def test_export(self):
+        """
+        Expect exported rows to point to exported parents
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            sdb = Spamdb(Category)
+            sdb.tree(Category, depth=2, branching=3)
+            paths = sdb.export(directory, iterations=2)
+            with io.open(paths[Category], newline='') as f:
+                rows = list(csv.reader(f))[1:]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEquals([row[1] for row in rows],
+                          [''] * 2 + ['1'] * 3 + ['2'] * 3)
+
+    def test_not_a_tree(self):
+        """
+        Expect models without a nullable foreign key to themselves to be
+        rejected
+        """
+        self.assertRaises(ValueError, Spamdb().tree, User, 2, 2)
+
+
+class EnsureTestCase(ModelTestCase):
+    """
+    Test that ensure() tops tables up to a number of rows
+    """
+    requires = [User, Blog, Category, UserCategory]
+
+    def test_ensure(self):
+        """
+        Expect only the missing rows to be spammed, and the key pools of
+        the related models to hold the keys of every row
+        """
+        sdb = Spamdb(Blog, User)
+        self.create_users(2)
+        self.assertEquals(sdb.ensure({User: 5, Blog: 8}),
+                          {User: 3, Blog: 8})
+        self.assertEquals(sdb.ensure({User: 5, Blog: 8}),
+                          {User: 0, Blog: 0})
+        self.assertEquals(sdb.key_pools[User].current_keys(),
+                          [1, 2, 3, 4, 5])
+        User.delete().where(User.id == 2).execute()
+        self.assertEquals(sdb.run(until={User: 5}, iterations=8),
+                          {User: 1, Blog: 0})
+        self.assertEquals(sdb.key_pools[User].current_keys(),
+                          [1, 3, 4, 5, 6])
+        self.assertRaises(ValueError, sdb.run, until={User: 5},
+                          counts={User: 9})
+        self.assertEquals((User.select().count(), Blog.select().count()),
+                          (5, 8))
+
+    def test_trees_and_links(self):
+        """
+        Expect trees to be topped up to a number of roots, and linked
+        models to be spammed only while they are empty
+        """
+        sdb = Spamdb(Category, User, UserCategory)
+        sdb.tree(Category, depth=2, branching=2)
+        sdb.link(UserCategory, degree=1)
+        self.assertEquals(sdb.ensure(iterations=3, batch_size=10),
+                          {Category: 9, User: 3, UserCategory: 3})
+        self.assertEquals(sdb.ensure(iterations=3),
+                          {Category: 0, User: 0, UserCategory: 0})
+        self.assertEquals(sdb.ensure(iterations=4),
+                          {Category: 3, User: 1, UserCategory: 0})
+        self.assertEquals(Category.select().where(
+            Category.parent >> None).count(), 4)
+
+
+class ServerSideTestCase(ModelTestCase):
+    """
+    Test that run(server_side=True) spams eligible models inside the
+    database
+    """
+    requires = [User, Reading]
+    now = datetime.datetime(2014, 1, 1, 12, 30)
+
+    def setUp(self):
+        super(ServerSideTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(ServerSideTestCase, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def assertReadings(self, n):
+        self.assertEquals(Reading.select().count(), n)
+        user_ids = set(user.id for user in User.select())
+        self.assertTrue(set(Reading.select(Reading.user).tuples()) <=
+                        set((user_id,) for user_id in user_ids))
+        for reading in Reading.select():
+            self.assertTrue(-10000 <= reading.value <= 10000)
+            self.assertTrue(-10000 <= reading.ratio <= 10000)
+            self.assertTrue(self.now - datetime.timedelta(days=60) <=
+                            reading.taken <= self.now)
+            self.assertTrue(self.now.date() - datetime.timedelta(days=60) <=
+                            reading.day <= self.now.date())
+            self.assertTrue(isinstance(reading.at, datetime.time))
+            self.assertTrue(reading.ok in (True, False))
+        self.assertTrue(0 < Reading.select().where(
+            Reading.total >> None).count() < n)
+
+    def test_insert_select(self):
+        """
+        Expect eligible models to be spammed by a statement, and the rest
+        from Python
+        """
+        sdb = Spamdb(Reading, User, now=self.now)
+        self.assertEquals(sdb.compile_insert_select(User), None)
+        counts = sdb.run(counts={User: 10, Reading: 300}, server_side=True)
+        self.assertEquals(counts, {User: 10, Reading: 300})
+        self.assertTrue(sdb.compile_insert_select(Reading) is not None)
+        self.assertReadings(300)
+
+    def test_batches(self):
+        """
+        Expect batches of batch_size rows, with or without checkpoints
+        """
+        path = os.path.join(self.directory, 'checkpoint')
+        sdb = Spamdb(User, Reading, now=self.now, profile=True)
+        sdb.run(counts={User: 5, Reading: 70}, batch_size=20,
+                server_side=True)
+        self.assertEquals(sdb.stats()['insert']['Reading']['calls'], 4)
+        sdb.run(counts={User: 0, Reading: 30}, batch_size=20,
+                server_side=True, checkpoint=path)
+        self.assertReadings(100)
+
+    def test_fallback(self):
+        """
+        Expect models with custom handlers or scattered foreign keys to be
+        spammed from Python
+        """
+        sdb = Spamdb(User, Reading, now=self.now)
+        sdb.run(counts={User: 5, Reading: 0})
+        self.assertTrue(sdb.compile_insert_select(Reading) is not None)
+        User.delete().where(User.id == 3).execute()
+        sdb = Spamdb(User, Reading)
+        self.assertEquals(sdb.compile_insert_select(Reading), None)
+
+        User.create(username='u', id=3)
+        sdb.strict_handler(Reading.value)(lambda *args: 7)
+        self.assertEquals(sdb.compile_insert_select(Reading), None)
+        sdb.run(counts={User: 0, Reading: 20}, server_side=True)
+        self.assertEquals(Reading.select().where(Reading.value == 7).count(),
+                          20)
+        self.assertRaises(ValueError, sdb.run, server_side=True, workers=2)
+
+
+class ExportTestCase(ModelTestCase):
+    """
+    Test that Spamdb.export writes the spammed rows to files
+    """
+    requires = [User, Blog, NullModel, Shop, Owner]
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(ExportTestCase, self).tearDown()
+        shutil.rmtree(self.path)
+
+    def read_lines(self, path):
+        with io.open(path, encoding='utf-8', newline='') as f:
+            return f.read().splitlines()
+
+    def test_export_csv(self):
+        """
+        Expect one file per model with a header line, pointing to the
+        exported rows, and nothing saved
+        """
+        paths = Spamdb(Blog, User).export(self.path, iterations=5,
+                                          batch_size=2)
+        self.assertEquals(paths[User], os.path.join(self.path, 'users.csv'))
+        users = self.read_lines(paths[User])
+        self.assertEquals(users[0], 'id,username')
+        self.assertEquals([line.split(',')[0] for line in users[1:]],
+                          ['1', '2', '3', '4', '5'])
+        with io.open(paths[Blog], encoding='utf-8', newline='') as f:
+            blogs = list(csv.reader(f))
+        self.assertEquals(len(blogs), 6)
+        self.assertEquals(blogs[0][:2], ['pk', 'user_id'])
+        for row in blogs[1:]:
+            self.assertTrue(1 <= int(row[1]) <= 5)
+        self.assertEquals(User.select().count(), 0)
+
+    def test_export_cycle(self):
+        """
+        Expect foreign keys to point to exported rows only, the ones
+        closing a cycle being left NULL, whatever is in the database
+        """
+        Shop.create(name='shop', owner=None)
+        Owner.create(shop=1)
+        paths = Spamdb(Shop, Owner).export(self.path, format='jsonl',
+                                           iterations=5)
+        shops = [json.loads(line) for line in self.read_lines(paths[Shop])]
+        owners = [json.loads(line) for line in self.read_lines(paths[Owner])]
+        self.assertEquals([shop['owner_id'] for shop in shops], [None] * 5)
+        self.assertTrue(all(1 <= owner['shop_id'] <= 5 for owner in owners))
+
+    def test_export_jsonl(self):
+        """
+        Expect one JSON object per row, keyed by column
+        """
+        paths = Spamdb(NullModel).export(self.path, format='jsonl',
+                                         iterations=4)
+        lines = self.read_lines(paths[NullModel])
+        self.assertEquals(len(lines), 4)
+        for line in lines:
+            obj = json.loads(line)
+            self.assertEquals(len(obj), len(NullModel._meta.fields))
+            if obj['date_field'] is not None:
+                datetime.datetime.strptime(obj['date_field'], '%Y-%m-%d')
+
+    def test_export_copy(self):
+        """
+        Expect tab separated values, with NULL as \\N
+        """
+        paths = Spamdb(NullModel).export(self.path, format='copy',
+                                         iterations=20)
+        lines = self.read_lines(paths[NullModel])
+        self.assertEquals(len(lines), 20)
+        values = [line.split('\t') for line in lines]
+        for row in values:
+            self.assertEquals(len(row), len(NullModel._meta.fields))
+            self.assertTrue(row[-1] in ('t', 'f', '\\N'))
+        self.assertTrue(any('\\N' in row for row in values))
+
+
+class SeedTestCase(unittest.TestCase):
+    """
+    Test that a seeded Spamdb spams reproducible values
+    """
+    now = datetime.datetime(2014, 1, 1, 12, 30)
+
+    def test_same_seed(self):
+        """
+        Expect the same rows for the same seed and reference time
+        """
+        rows = [Spamdb(seed=1, now=self.now).spam_rows(NullModel, 20)
+                for i in range(2)]
+        self.assertEquals(rows[0], rows[1])
+        fields = [Spamdb(seed=1, now=self.now).spam_fields(NullModel)
+                  for i in range(2)]
+        self.assertEquals(fields[0], fields[1])
+        other = Spamdb(seed=2, now=self.now).spam_rows(NullModel, 20)
+        self.assertNotEquals(rows[0], other)
+
+    def test_model_streams(self):
+        """
+        Expect the values of a model not to depend on other models
+        """
+        sdb = Spamdb(seed=1, now=self.now)
+        sdb.spam_rows(ChoicesModel, 10)
+        self.assertEquals(sdb.spam_rows(NullModel, 10),
+                          Spamdb(seed=1, now=self.now).spam_rows(NullModel, 10))
+
+    def test_reseed(self):
+        """
+        Expect reseeding with the same keys to repeat the same values
+        """
+        sdb = Spamdb(seed=1, now=self.now)
+        sdb.reseed(3)
+        rows = sdb.spam_rows(NullModel, 5)
+        sdb.reseed(4)
+        self.assertNotEquals(rows, sdb.spam_rows(NullModel, 5))
+        sdb.reseed(3)
+        self.assertEquals(rows, sdb.spam_rows(NullModel, 5))
+
+    def test_reference_time(self):
+        """
+        Expect dates spammed before the reference time
+        """
+        sdb = Spamdb(seed=1, now=self.now)
+        two_moths_ago = self.now - datetime.timedelta(days=61)
+        for attrs in sdb.spam_rows(FieldsTestModel, 20) + \
+                [sdb.spam_fields(FieldsTestModel) for i in range(20)]:
+            self.assertTrue(two_moths_ago <= attrs['datetime'] <= self.now)
+            self.assertTrue(two_moths_ago.date() <= attrs['date'] <=
+                            self.now.date())
+
+
+class CountsTestCase(ModelTestCase):
+    """
+    Test per model row counts and the fan-out of foreign keys
+    """
+    requires = [User, Blog]
+
+    def blogs_per_user(self):
+        query = Blog.select(Blog.user).tuples()
+        blogs = {}
+        for (user_id,) in query:
+            blogs[user_id] = blogs.get(user_id, 0) + 1
+        return [blogs.get(user_id, 0) for (user_id,) in
+                User.select(User.id).order_by(User.id).tuples()]
+
+    def test_append_count(self):
+        """
+        Expect models appended with a count to get that many rows
+        """
+        sdb = Spamdb()
+        sdb.append(User, count=3)
+        sdb.append(Blog, count=10)
+        self.assertEquals(sdb.run(iterations=2), {User: 3, Blog: 10})
+        self.assertEquals(User.select().count(), 3)
+        self.assertEquals(Blog.select().count(), 10)
+
+    def test_run_counts(self):
+        """
+        Expect counts given to run() to override iterations, in batches
+        """
+        sdb = Spamdb(User, Blog)
+        counts = sdb.run(iterations=2, batch_size=2, counts={Blog: 5})
+        self.assertEquals(counts, {User: 2, Blog: 5})
+        self.assertEquals(Blog.select().count(), 5)
+
+    def test_fixed_per_parent(self):
+        """
+        Expect every user to get the same number of blogs
+        """
+        sdb = Spamdb()
+        sdb.append(User, count=3)
+        sdb.append(Blog, count=6)
+        sdb.fan_out(Blog.user, FixedPerParent(2))
+        sdb.run(batch_size=4)
+        self.assertEquals(self.blogs_per_user(), [2, 2, 2])
+        self.assertRaises(ValueError, sdb.run, batch_size=2, workers=2)
+
+    def test_fixed_per_parent_nulls(self):
+        """
+        Expect rows left NULL not to be counted for any parent
+        """
+        sdb = Spamdb(seed=3)
+        sdb.key_pools[Parent] = KeyPool(Parent, keys=[1, 2, 3])
+        sdb.fan_out(Orphan.parent, FixedPerParent(2))
+        rows = sdb.spam_rows(Orphan, 12)
+        keys = [attrs['parent'] for attrs in rows if 'parent' in attrs]
+        self.assertTrue(0 < len(keys) < 12)
+        self.assertEquals(keys, [(i // 2) % 3 + 1 for i in range(len(keys))])
+
+    def test_zipf(self):
+        """
+        Expect the first users to get most of the blogs
+        """
+        sdb = Spamdb(seed=1)
+        sdb.append(User, count=10)
+        sdb.append(Blog, count=300)
+        sdb.fan_out(Blog.user, Zipf(1.5))
+        sdb.run(batch_size=100)
+        blogs = self.blogs_per_user()
+        self.assertEquals(sum(blogs), 300)
+        self.assertTrue(blogs[0] > sum(blogs[5:]))
+
+    def test_zipf_sample(self):
+        """
+        Expect keys to be picked less often the further they are
+        """
+        zipf = Zipf()
+        rng = random.Random(0)
+        keys = list(range(50))
+        picks = [zipf.sample(keys, rng) for i in range(5000)]
+        self.assertTrue(set(picks) <= set(keys))
+        self.assertTrue(picks.count(0) > picks.count(1) > picks.count(10))
+
+
+class WritePolicyTestCase(ModelTestCase):
+    """
+    Test that run() commits following a WritePolicy, with the pragmas given
+    """
+    requires = [User, Blog]
+
+    def setUp(self):
+        super(WritePolicyTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(WritePolicyTestCase, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def count_commits(self, sdb, **kwargs):
+        database = User._meta.database
+        commits = []
+        rows = lambda: User.select().count() + Blog.select().count()
+        start = rows()
+
+        def commit():
+            commits.append(rows() - start)
+            type(database).commit(database)
+
+        database.commit = commit
+        try:
+            sdb.run(**kwargs)
+        finally:
+            del database.commit
+        return commits
+
+    def test_rows(self):
+        """
+        Expect a commit every 4 rows, and one at the end
+        """
+        sdb = Spamdb(User, Blog, write_policy=WritePolicy(rows=4))
+        self.assertEquals(self.count_commits(sdb, iterations=5), [4, 8, 10])
+        self.assertEquals(self.count_commits(sdb, iterations=5,
+                                             batch_size=3), [5, 10, 10])
+        sdb.write_policy = WritePolicy(seconds=0)
+        self.assertEquals(len(self.count_commits(sdb, iterations=3)), 7)
+        sdb.write_policy = WritePolicy()
+        self.assertEquals(self.count_commits(sdb, iterations=3), [6])
+        self.assertEquals(self.count_commits(Spamdb(User), iterations=3),
+                          [1, 2, 3])
+
+    def test_rollback(self):
+        """
+        Expect the rows since the last commit to be rolled back on errors
+        """
+        sdb = Spamdb(User, write_policy=WritePolicy(rows=4))
+        usernames = iter(['u%d' % i for i in range(6)])
+        sdb.strict_handler(User.username)(lambda *args: next(usernames))
+        self.assertRaises(StopIteration, sdb.run, iterations=10)
+        self.assertEquals(User.select().count(), 4)
+
+    def test_checkpoint(self):
+        """
+        Expect checkpoints to be saved once their rows are committed
+        """
+        path = os.path.join(self.directory, 'checkpoint')
+        sdb = Spamdb(User, Blog, write_policy=WritePolicy(rows=4))
+        commits = self.count_commits(sdb, iterations=5, batch_size=2,
+                                     checkpoint=path)
+        with open(path) as f:
+            self.assertEquals(json.load(f)['done'], [5, 5])
+        self.assertEquals(sdb.run(iterations=5, checkpoint=path,
+                                  resume=True), {User: 5, Blog: 5})
+        self.assertEquals(commits[-1], 10)
+        self.assertEquals(User.select().count(), 5)
+
+    def test_pragmas(self):
+        """
+        Expect the pragmas to hold while the run lasts, in every process
+        """
+        database = User._meta.database
+        synchronous = database.execute_sql('PRAGMA synchronous').fetchone()
+        sdb = Spamdb(User, sqlite_pragmas=(('synchronous', 'off'),),
+                     write_policy=WritePolicy(rows=100))
+
+        # each row stores the value seen by the process spamming it
+        @sdb.strict_handler(User.username)
+        def spam_username(model, field_type, field_name):
+            return 'synchronous=%d' % database.execute_sql(
+                'PRAGMA synchronous').fetchone()[0]
+
+        sdb.run(iterations=3)
+        sdb.run(iterations=3, batch_size=1, workers=2)
+        self.assertEquals([user.username for user in User.select()],
+                          ['synchronous=0'] * 6)
+        self.assertEquals(database.execute_sql(
+            'PRAGMA synchronous').fetchone(), synchronous)
+
+    def test_connection_pool(self):
+        """
+        Expect new connections to be configured once, and persistent
+        pragmas to stay
+        """
+        directory = tempfile.mkdtemp()
+        database = SqliteDatabase(os.path.join(directory, 'db'))
+        try:
+            pool = ConnectionPool([database], SEEDING_PRAGMAS)
+            pool.connect()
+            pragma = lambda name: database.execute_sql(
+                'PRAGMA %s' % name).fetchone()[0]
+            self.assertEquals((pragma('journal_mode'), pragma('synchronous'),
+                               pragma('cache_size')), ('wal', 0, -262144))
+            database.execute_sql('PRAGMA synchronous = 1')
+            pool.connect()
+            self.assertEquals(pragma('synchronous'), 1)
+            pool.connect(reopen=True)
+            self.assertEquals(pragma('synchronous'), 0)
+            pool.restore()
+            self.assertEquals((pragma('journal_mode'), pragma('synchronous')),
+                              ('wal', 2))
+        finally:
+            database.close()
+            shutil.rmtree(directory)
+
+
+class CheckpointTestCase(ModelTestCase):
+    """
+    Test that checkpointed runs can be resumed
+    """
+    requires = [User, Blog, UniqueModel]
+    now = datetime.datetime(2014, 1, 1, 12, 30)
+
+    def setUp(self):
+        super(CheckpointTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint')
+
+    def tearDown(self):
+        super(CheckpointTestCase, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def spamdb(self, fail_at=None):
+        sdb = Spamdb(User, Blog, seed=1, now=self.now)
+        calls = []
+
+        @sdb.strict_handler(Blog.title)
+        def spam_title(model, field_type, field_name):
+            calls.append(1)
+            if len(calls) == fail_at:
+                raise RuntimeError('failed')
+            return 'title'
+        return sdb
+
+    def rows(self):
+        return (list(User.select(User.id, User.username).tuples()),
+                list(Blog.select(Blog.pk, Blog.user, Blog.pub_date).tuples()))
+
+    def test_resume(self):
+        """
+        Expect a resumed run to spam the same rows as a run that did not
+        fail
+        """
+        self.spamdb().run(iterations=10, batch_size=3)
+        expected = self.rows()
+        drop_tables(self.requires)
+        create_tables(self.requires)
+
+        sdb = self.spamdb(fail_at=8)
+        self.assertRaises(RuntimeError, sdb.run, iterations=10, batch_size=3,
+                          checkpoint=self.path)
+        self.assertEquals(Blog.select().count(), 6)
+        counts = self.spamdb().run(checkpoint=self.path, resume=True)
+        self.assertEquals(counts, {User: 10, Blog: 10})
+        self.assertEquals(self.rows(), expected)
+
+    def test_unsaved_rows(self):
+        """
+        Expect rows inserted after the last checkpoint not to be duplicated
+        """
+        module = sys.modules[Spamdb.__module__]
+        save = module.checkpoints.save
+        saves = []
+
+        def failing_save(path, state):
+            saves.append(1)
+            if len(saves) == 3:
+                raise IOError('disk full')
+            save(path, state)
+
+        module.checkpoints.save = failing_save
+        try:
+            self.assertRaises(IOError, Spamdb(User).run, iterations=10,
+                              batch_size=4, checkpoint=self.path)
+        finally:
+            module.checkpoints.save = save
+        self.assertEquals(User.select().count(), 8)
+
+        Spamdb(User).run(checkpoint=self.path, resume=True)
+        self.assertEquals(User.select().count(), 10)
+
+    def test_unsaved_unique_rows(self):
+        """
+        Expect the unique values of rows inserted after the last checkpoint
+        to be spammed again when resuming
+        """
+        Spamdb(UniqueModel, seed=1).run(iterations=10, batch_size=4)
+        expected = [m.name for m in UniqueModel.select().order_by(
+            UniqueModel.id)]
+        UniqueModel.delete().execute()
+
+        module = sys.modules[Spamdb.__module__]
+        save = module.checkpoints.save
+        saves = []
+
+        def failing_save(path, state):
+            saves.append(1)
+            if len(saves) == 3:
+                raise IOError('disk full')
+            save(path, state)
+
+        module.checkpoints.save = failing_save
+        try:
+            self.assertRaises(IOError, Spamdb(UniqueModel, seed=1).run,
+                              iterations=10, batch_size=4,
+                              checkpoint=self.path)
+        finally:
+            module.checkpoints.save = save
+        Spamdb(UniqueModel, seed=1).run(checkpoint=self.path, resume=True)
+        self.assertEquals([m.name for m in UniqueModel.select().order_by(
+            UniqueModel.id)], expected)
+
+    def test_other_models(self):
+        """
+        Expect checkpoints of other models not to be resumed
+        """
+        Spamdb(User).run(iterations=2, batch_size=1, checkpoint=self.path)
+        self.assertRaises(ValueError, Spamdb(Blog).run, checkpoint=self.path,
+                          resume=True)
+
+
+class ProfileTestCase(ModelTestCase):
+    """
+    Test the counters collected by a profiling Spamdb
+    """
+    requires = [User, Blog]
+
+    def test_disabled(self):
+        """
+        Expect no counters and no wrapped handlers unless profiling
+        """
+        sdb = Spamdb(User, Blog)
+        sdb.run(iterations=2)
+        self.assertEquals(sdb.stats()['rows'], {})
+        self.assertEquals(sdb.stats()['queries'], 0)
+        handler = dict((step[0], step[2]) for step in sdb.spam_plan(Blog))
+        self.assertEquals(handler['title'].func, spam_charfield)
+
+    def test_run(self):
+        """
+        Expect handler calls, constructions, saves, queries and key pool
+        hits to be counted, and hooks to be called
+        """
+        events = []
+        sdb = Spamdb(User, Blog, profile=True)
+        sdb.add_hook(lambda event, name, seconds: events.append(event))
+        sdb.run(iterations=3)
+        stats = sdb.stats()
+        self.assertEquals(stats['rows'], {'User': 3, 'Blog': 3})
+        self.assertEquals(stats['handler']['Blog.title']['calls'], 3)
+        self.assertEquals(stats['construct']['Blog']['calls'], 3)
+        self.assertEquals(stats['save']['User']['calls'], 3)
+        self.assertTrue(stats['save']['User']['seconds'] > 0)
+        self.assertTrue(stats['queries'] >= 6)
+        self.assertEquals(stats['pool_hits'] + stats['pool_misses'], 3)
+        self.assertEquals(events.count('save'), 6)
+
+        sdb.reset_stats()
+        self.assertEquals(sdb.stats()['rows'], {})
+        self.assertEquals(sdb.stats()['pool_misses'], 0)
+
+    def test_batch(self):
+        """
+        Expect multi-row inserts to be timed
+        """
+        sdb = Spamdb(User, Blog, profile=True)
+        sdb.run(iterations=5, batch_size=2)
+        stats = sdb.stats()
+        self.assertEquals(stats['insert']['Blog']['calls'], 3)
+        self.assertEquals(stats['rows'], {'User': 5, 'Blog': 5})
+        self.assertEquals((stats['pool_hits'], stats['pool_misses']), (4, 1))
+
+    def test_workers(self):
+        """
+        Expect the counters of worker processes to be added up
+        """
+        sdb = Spamdb(User, Blog, profile=True)
+        sdb.run(iterations=6, batch_size=2, workers=2)
+        stats = sdb.stats()
+        self.assertEquals(stats['rows'], {'User': 6, 'Blog': 6})
+        self.assertEquals(stats['insert']['Blog']['calls'], 3)
+        self.assertTrue(stats['queries'] >= 6)
+        self.assertEquals(stats['pool_hits'] + stats['pool_misses'], 6)
+
+    def test_progress(self):
+        """
+        Expect the progress callback to get the rows spammed without
+        profiling, including the ones of worker processes
+        """
+        for workers in (None, 2):
+            drop_tables(self.requires)
+            create_tables(self.requires)
+            rows = {}
+            sdb = Spamdb(User, Blog, progress=lambda model, n: rows.update(
+                {model: rows.get(model, 0) + n}))
+            sdb.run(iterations=5, batch_size=2, workers=workers)
+            self.assertEquals(rows, {User: 5, Blog: 5})
+            self.assertEquals(sdb.stats()['rows'], {})
+
+    def test_query_counter(self):
+        """
+        Expect the execute_sql attribute of a database to be put back after
+        a profiling run, and overlapping counters to end in any order
+        """
+        database = User._meta.database
+        queries = []
+
+        def execute_sql(*args, **kwargs):
+            queries.append(args[0])
+            return type(database).execute_sql(database, *args, **kwargs)
+
+        database.execute_sql = execute_sql
+        try:
+            sdb = Spamdb(User, profile=True)
+            sdb.run(iterations=2)
+            self.assertTrue(database.execute_sql is execute_sql)
+            self.assertEquals(sdb.stats()['queries'], len(queries))
+
+            first, second = Spamdb(profile=True), Spamdb(profile=True)
+            counter = QueryCounter.add(database, first)
+            self.assertTrue(QueryCounter.add(database, second) is counter)
+            User.select().count()
+            counter.remove(first)
+            User.select().count()
+            self.assertTrue(database.execute_sql is counter)
+            counter.remove(second)
+            self.assertTrue(database.execute_sql is execute_sql)
+            self.assertEquals((first.queries, second.queries), (1, 2))
+        finally:
+            del database.execute_sql
+        self.assertFalse('execute_sql' in database.__dict__)
+
+
+class LinkTestCase(ModelTestCase):
+    """
+    Test that join models are spammed as distinct pairs of related rows
+    """
+    requires = [User, Category, UserCategory, Relationship]
+
+    def pairs(self, model, left, right):
+        return list(model.select(left, right).tuples())
+
+    def test_link(self):
+        """
+        Expect every user to be linked to 3 distinct categories
+        """
+        sdb = Spamdb(UserCategory, Category, User)
+        sdb.link(UserCategory, degree=3)
+        counts = sdb.run(iterations=5, batch_size=4,
+                         counts={Category: 4})
+        self.assertEquals(counts, {User: 5, Category: 4, UserCategory: 15})
+        pairs = self.pairs(UserCategory, UserCategory.user,
+                           UserCategory.category)
+        self.assertEquals(len(set(pairs)), 15)
+        for user in User.select():
+            self.assertEquals(len([p for p in pairs if p[0] == user.id]), 3)
+
+    def test_self_link(self):
+        """
+        Expect rows not to be linked to themselves, even if degree is
+        greater than the number of rows
+        """
+        sdb = Spamdb(User, Relationship, seed=1)
+        sdb.link(Relationship, degree=(0, 100))
+        sdb.fan_out(Relationship.to_user, Zipf())
+        sdb.run(iterations=6)
+        pairs = self.pairs(Relationship, Relationship.from_user,
+                           Relationship.to_user)
+        self.assertEquals(len(set(pairs)), len(pairs))
+        self.assertTrue(all(a != b for a, b in pairs))
+        self.assertTrue(all(len([p for p in pairs if p[0] == user_id]) <= 5
+                            for user_id in range(1, 7)))
+
+    def test_export(self):
+        """
+        Expect exported join rows to link exported rows
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            sdb = Spamdb(User, Category, UserCategory)
+            sdb.link(UserCategory, degree=2, left=UserCategory.category,
+                     right=UserCategory.user)
+            paths = sdb.export(directory, iterations=3)
+            with io.open(paths[UserCategory], newline='') as f:
+                rows = list(csv.reader(f))[1:]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEquals(len(rows), 6)
+        self.assertTrue(all(1 <= int(row[1]) <= 3 for row in rows))
+
+    def test_errors(self):
+        """
+        Expect a ValueError for models without two foreign keys, and for
+        checkpointed runs, which would link the rows again when resuming
+        """
+        self.assertRaises(ValueError, Spamdb(Category).link, Category, 2)
+        sdb = Spamdb(User, Category, UserCategory)
+        sdb.link(UserCategory, degree=2)
+        path = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        try:
+            self.assertRaises(ValueError, sdb.run, checkpoint=path)
+        finally:
+            shutil.rmtree(os.path.dirname(path))
+        self.assertEquals(User.select().count(), 0)
+
+
+class UniqueTestCase(ModelTestCase):
+    """
+    Test that values of unique fields and indexes are not spammed twice
+    """
+    requires = [UniqueModel, MultiIndexModel, OverlappingIndexModel]
+
+    def few_names(self, sdb, names):
+        @sdb.strict_handler(UniqueModel.name)
+        def spam_name(model, field_type, field_name):
+            return random.choice(names)
+
+    def test_unique_field(self):
+        """
+        Expect duplicated values to be spammed again, and a ValueError once
+        there are no values left
+        """
+        sdb = Spamdb()
+        self.few_names(sdb, ['a', 'b', 'c'])
+        names = [row['name'] for row in sdb.spam_rows(UniqueModel, 3)]
+        self.assertEquals(sorted(names), ['a', 'b', 'c'])
+        self.assertRaises(ValueError, sdb.spam_fields, UniqueModel)
+
+    def test_unique_index(self):
+        """
+        Expect pairs of a unique index not to repeat, while single values
+        may repeat
+        """
+        sdb = Spamdb()
+
+        @sdb.global_handler(CharField)
+        def spam_char(model, field_type, field_name):
+            return random.choice(['a', 'b'])
+
+        rows = sdb.spam_rows(MultiIndexModel, 4)
+        pairs = set((row['f1'], row['f2']) for row in rows)
+        self.assertEquals(len(pairs), 4)
+        self.assertRaises(ValueError, sdb.spam_rows, MultiIndexModel, 1)
+
+    def test_overlapping_indexes(self):
+        """
+        Expect values spammed again for one index to be checked against the
+        indexes sharing their fields, so no duplicate reaches the database
+        """
+        for seed in range(20):
+            OverlappingIndexModel.delete().execute()
+            sdb = Spamdb(OverlappingIndexModel, seed=seed)
+
+            @sdb.global_handler(CharField)
+            @seedable
+            def spam_char(model, field_type, field_name, rng):
+                return rng.choice(['x', 'y', 'z'])
+
+            sdb.run(iterations=6, batch_size=6)
+            rows = list(OverlappingIndexModel.select().tuples())
+            self.assertEquals(len(rows), 6)
+            self.assertEquals(len(set((a, b) for _, a, b, c in rows)), 6)
+            self.assertEquals(len(set((b, c) for _, a, b, c in rows)), 6)
+
+    def test_long_runs(self):
+        """
+        Expect unique single column indexes and primary keys not to run
+        out of values, like unique fields
+        """
+        sdb = Spamdb(seed=1)
+        for field in (UniqueIndexCharModel.email, CharKeyModel.code):
+            values = [row[field.name]
+                      for row in sdb.spam_rows(field.model_class, 3000)]
+            self.assertEquals(len(set(values)), 3000)
+
+    def test_preload(self):
+        """
+        Expect values already in the table not to be spammed by run()
+        """
+        UniqueModel.create(name='a')
+        sdb = Spamdb(UniqueModel)
+        self.few_names(sdb, ['a', 'b'])
+        sdb.run(iterations=1)
+        self.assertEquals(sorted(m.name for m in UniqueModel.select()),
+                          ['a', 'b'])
+
+    def test_run(self):
+        """
+        Expect many rows of unique fields to be saved without errors
+        """
+        sdb = Spamdb(UniqueModel, MultiIndexModel)
+        sdb.run(iterations=300, batch_size=100)
+        self.assertEquals(UniqueModel.select().count(), 300)
+        self.assertEquals(MultiIndexModel.select().count(), 300)
+
+
+class SpamPlanTestCase(unittest.TestCase):
+    """
+    Test that Spamdb compiles and caches a spam plan for each model
+    """
+
+    def test_plan_is_cached(self):
+        """
+        Expect the same plan to be reused, with a handler for every field
+        """
+        sdb = Spamdb(User)
+        plan = sdb.spam_plan(User)
+        self.assertTrue(sdb.spam_plan(User) is plan)
+        self.assertEquals([step[0] for step in plan], ['id', 'username'])
+        self.assertEquals(plan[1][2].func, spam_charfield)
+        self.assertTrue(plan[1][2].keywords['rng'] is sdb.random_for(User))
+
+    def test_plan_invalidation(self):
+        """
+        Expect registering a handler to drop the compiled plans
+        """
+        sdb = Spamdb(User)
+        sdb.spam_fields(User)
+
+        @sdb.strict_handler(User.username)
+        def spam_username(model, field_type, field_name):
+            return 'strict'
+
+        self.assertEquals(sdb.spam_fields(User)['username'], 'strict')
+
+        @sdb.global_handler(CharField)
+        def spam_charfield(model, field_type, field_name):
+            return 'global'
+
+        self.assertEquals(sdb.spam_fields(User)['username'], 'strict')
+        self.assertEquals(sdb.spam_fields(UniqueModel)['name'], 'global')
+
+    def test_fields_without_handler(self):
+        """
+        Expect fields without a handler to be left out
+        """
+        sdb = Spamdb(User)
+        del sdb.global_handlers[CharField]
+        self.assertEquals(sdb.spam_fields(User), {'id': None})
+
+
 class ChoicesTestCase(ModelTestCase):
     """
     Test that a field with one of it's choices param
@@ -556,5 +2015,303 @@ class RunIterationsTestCase(ModelTestCase):
         self.assertEquals(Blog.select().count(), 3)
 
 
+class RunBatchTestCase(ModelTestCase):
+    """
+    Test that run() with a batch_size writes the spammed rows with
+    multi-row inserts.
+    """
+    requires = [User, Blog, NullModel]
+
+    def test_batch_iterations(self):
+        """
+        Expect the same amount of rows as the one row at a time mode, and
+        the number of rows per model returned
+        """
+        sdb = Spamdb(User, User, Blog)
+        counts = sdb.run(iterations=7, batch_size=3)
+        self.assertEquals(counts, {User: 14, Blog: 7})
+        self.assertEquals(User.select().count(), 14)
+        self.assertEquals(Blog.select().count(), 7)
+
+    def test_batch_foreign_keys(self):
+        """
+        Expect rows of a model to point to rows inserted by previous batches
+        """
+        Spamdb(User, Blog).run(iterations=5, batch_size=2)
+        user_ids = set(u.id for u in User.select())
+        for blog in Blog.select():
+            self.assertTrue(blog.user.id in user_ids)
+
+    def test_batch_insert_many(self):
+        """
+        Expect insert_many, where peewee has it, to be given chunks within
+        the limit of host parameters
+        """
+        chunks = []
+
+        def insert_many(cls, rows):
+            chunks.append(len(rows))
+            return cls.insert(**rows[0])
+
+        User.insert_many = classmethod(insert_many)
+        try:
+            Spamdb(User).run(iterations=2500, batch_size=2500)
+        finally:
+            del User.insert_many
+        self.assertEquals(chunks, [999, 999, 502])
+
+    def test_batch_nullable_fields(self):
+        """
+        Expect nullable fields skipped in some rows to be stored as NULL,
+        and the others to get values
+        """
+        Spamdb(NullModel, seed=42).run(iterations=20, batch_size=20)
+        self.assertEquals(NullModel.select().count(), 20)
+        nulls = NullModel.select().where(NullModel.int_field >> None)
+        self.assertTrue(0 < nulls.count() < 20)
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'arun requires Python 3.5')
+class AsyncRunTestCase(unittest.TestCase):
+    """
+    Test that arun() spams like run(), writing from threads
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = SqliteDatabase(os.path.join(self.directory, 'db'),
+                                       threadlocals=True)
+
+        class Meta:
+            database = self.database
+
+        self.author = type('Author', (Model,), {
+            'name': CharField(), 'Meta': Meta})
+        self.post = type('Post', (Model,), {
+            'author': ForeignKeyField(self.author), 'title': CharField(),
+            'Meta': Meta})
+        self.author.create_table()
+        self.post.create_table()
+
+    def tearDown(self):
+        self.database.close()
+        shutil.rmtree(self.directory)
+
+    def arun(self, sdb, *args, **kwargs):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(sdb.arun(*args, **kwargs))
+        finally:
+            loop.close()
+
+    def test_arun(self):
+        """
+        Expect every row to be written, pointing to written rows
+        """
+        sdb = Spamdb(self.post, self.author)
+        counts = self.arun(sdb, 20, batch_size=3, connections=2,
+                           counts={self.post: 50})
+        self.assertEquals(counts, {self.author: 20, self.post: 50})
+        self.assertEquals(self.post.select().count(), 50)
+        author_ids = set(a.id for a in self.author.select())
+        for post in self.post.select():
+            self.assertTrue(post.author.id in author_ids)
+
+    def test_threadlocals(self):
+        """
+        Expect a ValueError for databases sharing a connection among threads
+        """
+        database = SqliteDatabase(os.path.join(self.directory, 'shared'))
+        model = type('Shared', (Model,), {
+            'name': CharField(), 'Meta': type('Meta', (), {
+                'database': database})})
+        model.create_table()
+        self.assertRaises(ValueError, self.arun, Spamdb(model), 2)
+        self.assertEquals(model.select().count(), 0)
+        database.close()
+
+    def test_tree(self):
+        """
+        Expect each level of a tree to point to the rows of the previous one
+        """
+        topic = type('Topic', (Model,), {
+            'parent': ForeignKeyField('self', null=True,
+                                      related_name='children'),
+            'Meta': type('Meta', (object,), {'database': self.database})})
+        topic.create_table()
+        sdb = Spamdb(topic)
+        sdb.tree(topic, depth=3, branching=3)
+        counts = self.arun(sdb, 2, batch_size=4, connections=2)
+        self.assertEquals(counts, {topic: 26})
+        self.assertEquals(topic.select().where(topic.parent >> None).count(),
+                          2)
+        for row in topic.select():
+            self.assertTrue(row.children.count() in (0, 3))
+
+    def test_write_error(self):
+        """
+        Expect the errors of the writes to be raised
+        """
+        self.post.drop_table()
+        sdb = Spamdb(self.author, self.post)
+        logger = logging.getLogger('peewee')
+        logger.disabled = True  # peewee logs the failed query
+        try:
+            self.assertRaises(OperationalError, self.arun, sdb, 10,
+                              batch_size=2, queue_size=1)
+        finally:
+            logger.disabled = False
+
+
+class BenchTestCase(unittest.TestCase):
+    """
+    Test that the benchmarks run
+    """
+
+    def test_results(self):
+        """
+        Expect a positive result for every benchmark of the groups given
+        """
+        results = bench.run_benchmarks(rows=5, only=('handlers', 'run'))
+        names = [result['name'] for result in results]
+        self.assertTrue('handler CharField' in names)
+        self.assertTrue('file fk_heavy run batch' in names)
+        self.assertTrue(all(result['value'] > 0 for result in results))
+        json.dumps(results)
+
+class CliTestCase(ModelTestCase):
+    """
+    Test the python -m spamdb command
+    """
+    requires = [User, Blog]
+
+    def main(self, *argv):
+        """
+        Runs the command, leaving its output out of the test report
+        """
+        streams = sys.stdout, sys.stderr
+        output = io.StringIO if sys.version_info[0] > 2 else io.BytesIO
+        sys.stdout, sys.stderr = output(), output()
+        try:
+            return cli.main(list(argv))
+        finally:
+            self.stderr = sys.stderr.getvalue()
+            sys.stdout, sys.stderr = streams
+
+    def test_run(self):
+        """
+        Expect the selected models to be spammed with the counts given
+        """
+        status = self.main('tests', 'User', 'Blog', '-n', '4', '-c', 'Blog=7',
+                           '-b', '3', '--seed', '1')
+        self.assertEquals(status, 0)
+        self.assertEquals(User.select().count(), 4)
+        self.assertEquals(Blog.select().count(), 7)
+
+    def test_write_policy(self):
+        """
+        Expect the commit options and the SQLite pragmas to be taken, and
+        a warning for the commit options with workers
+        """
+        try:
+            for options in (['--commit-every', '5'],
+                            ['--commit-interval', '0'],
+                            ['--commit-every', '3', '--sqlite-seeding']):
+                status = self.main('tests', 'User', 'Blog', '-n', '4', '-q',
+                                   *options)
+                self.assertEquals(status, 0)
+                self.assertEquals(self.stderr, '')
+        finally:
+            # WAL is stored in the file, unlike the other seeding pragmas
+            User._meta.database.execute_sql('PRAGMA journal_mode = delete')
+        self.assertEquals(User.select().count(), 12)
+        self.assertEquals(Blog.select().count(), 12)
+        status = self.main('tests', 'User', '-n', '2', '-b', '1', '-w', '2',
+                           '--commit-interval', '0', '-q')
+        self.assertEquals(status, 0)
+        self.assertTrue('no effect with --workers' in self.stderr)
+        self.assertEquals(User.select().count(), 14)
+
+    def test_top_up(self):
+        """
+        Expect only the missing rows to be spammed
+        """
+        self.create_users(3)
+        self.main('tests', 'User', '-n', '5', '--top-up', '-q')
+        self.assertEquals(User.select().count(), 5)
+
+    def test_export(self):
+        """
+        Expect files to be written instead of rows
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            self.main('tests', 'User', '-n', '3', '--export', directory,
+                      '--format', 'jsonl', '-q')
+            with open(os.path.join(directory, 'users.jsonl')) as f:
+                self.assertEquals(len(f.readlines()), 3)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEquals(User.select().count(), 0)
+
+    def test_profile(self):
+        """
+        Expect the counters to be reported with --profile only
+        """
+        status = self.main('tests', 'User', '-n', '2', '--profile', '-q')
+        self.assertEquals(status, 0)
+        self.assertTrue('queries' in self.stderr)
+        self.main('tests', 'User', '-n', '2')
+        self.assertTrue('2 rows' in self.stderr)
+        self.assertFalse('queries' in self.stderr)
+
+    def test_export_workers(self):
+        """
+        Expect an error status for --workers with --export, which has none
+        """
+        directory = tempfile.mkdtemp()
+        try:
+            self.assertEquals(self.main('tests', 'User', '--export',
+                                        directory, '-w', '2'), 2)
+            self.assertEquals(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_all_models(self):
+        """
+        Expect every model of the module to be spammed when none is named,
+        but their abstract bases
+        """
+        models = cli.find_models(sys.modules[__name__], [])
+        self.assertTrue(User in models and BlogTwo in models and
+                        Blog in models)
+        self.assertFalse(TestModel in models)
+
+        module = types.ModuleType('cli_models')
+        module.BaseModel = type('BaseModel', (Model,), {
+            '__module__': 'cli_models',
+            'Meta': type('Meta', (), {'database': User._meta.database})})
+        module.Note = type('Note', (module.BaseModel,), {
+            '__module__': 'cli_models', 'text': CharField()})
+        sys.modules['cli_models'] = module
+        try:
+            status = self.main('cli_models', '-n', '3', '--create-tables',
+                               '-q')
+            self.assertEquals(status, 0)
+            self.assertEquals(module.Note.select().count(), 3)
+            self.assertFalse(module.BaseModel.table_exists())
+        finally:
+            del sys.modules['cli_models']
+            module.Note.drop_table(True)
+            module.BaseModel.drop_table(True)
+
+    def test_unknown_model(self):
+        """
+        Expect an error status for models not in the module
+        """
+        self.assertEquals(self.main('tests', 'Nope'), 2)
+        self.assertEquals(self.main('tests', 'User', '-c', 'Blog=1'), 2)
+
 if __name__ == '__main__':
     unittest.main()